@@ -4,7 +4,6 @@ import difflib
 import importlib
 import logging
 import os
-import random
 import sys
 import textwrap
 import time
@@ -20,7 +19,7 @@ from discord.ext import commands, tasks
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pretty_help import PrettyHelp
 
-from utils import config, humanlist, logger, report_bug, send_chunks
+from utils import CCog, config, humanlist, logger, report_bug, send_chunks
 
 __all__ = ['CBot', 'bot']
 
@@ -66,7 +65,12 @@ class CBot(commands.Bot):
         await self.close()
 
     async def close(self) -> None:
-        """Closes the bot and its session."""
+        """Closes the bot, its cogs and its session."""
+        if self.is_closed():
+            return
+        for cog in list(self.cogs.values()):
+            if isinstance(cog, CCog):
+                await cog.shutdown()
         await self.session.close()
         if hasattr(self, 'server') and self.server is not None:
             await self.server.shutdown()
@@ -192,11 +196,11 @@ async def before_invoke(ctx: commands.Context):
 @tasks.loop(seconds=60, reconnect=True)
 async def update_hentai_presence():
     await bot.wait_until_ready()
-    hentai = await bot.cogs["NSFW"].hanime_random()  # type: ignore
+    name = await bot.cogs["NSFW"].random_hentai_name()  # type: ignore
     await bot.change_presence(
         activity=discord.Activity(
             type=discord.ActivityType.watching,
-            name=random.choice(hentai[:5])['name'],
+            name=name,
         )
     )
 
@@ -2,17 +2,21 @@ from __future__ import annotations
 
 import asyncio
 import inspect
+import itertools
 import json
-from datetime import datetime, timedelta
-from itertools import groupby
-from typing import Any, Optional, TypeVar, Union
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar, Union
 
 import discord
 import genshinstats as gs
-from cachetools import TTLCache
-from discord.ext import commands
+import numpy as np
+from cachetools import LRUCache, TTLCache
+from discord.ext import commands, tasks
 from genshinstats.pretty import character_icons
-from utils import CCog, discord_input, grouper, send_pages, to_thread
+from pymongo import UpdateOne
+from utils import CCog, HoyolabClient, MongoCache, discord_input, grouper, send_pages, wrap
 
 GENSHIN_LOGO = "https://yt3.ggpht.com/ytc/AKedOLRtloUOEZcHaRhCYeKyHRg31e54hCcIaVfQ7IN-=s900-c-k-c0x00ffffff-no-rj"
 T = TypeVar('T')
@@ -47,19 +51,396 @@ abyss_banners = {
     12: base + "pc12.43f28b10.png",
 }
 
+# the second character event banner shares pity with the first one
+pity_banners = {100: 100, 200: 200, 301: 301, 400: 301, 302: 302}
+banner_names = {100: "Novice Wish", 200: "Permanent Wish", 301: "Character Event Wish", 302: "Weapon Event Wish"}
+max_pity = {100: 90, 200: 90, 301: 90, 302: 80}
+
+# leaderboard categories: snapshot field, title and value format
+leaderboards = {
+    'achievements': ('achievements', "Achievements", "{} achievements"),
+    'abyss': ('abyss_stars', "Spiral Abyss", "{} stars"),
+    'exploration': ('exploration', "Exploration", "{}% explored on average"),
+}
+
+def _wish_stats(rarity: np.ndarray, banner: np.ndarray) -> list[dict[str, Any]]:
+    """Computes pity, rates and summaries of every banner from chronologically ordered pull columns"""
+    stats = []
+    for banner_type in np.unique(banner):
+        r = rarity[banner == banner_type]
+        five, four = np.flatnonzero(r == 5), np.flatnonzero(r == 4)
+        # a 5★ also resets the 4★ pity
+        four_or_more = np.flatnonzero(r >= 4)
+        stats.append({
+            'banner_type': int(banner_type),
+            'total': len(r),
+            'five_stars': len(five),
+            'four_stars': len(four),
+            'five_star_rate': len(five) / len(r),
+            'four_star_rate': len(four) / len(r),
+            'five_star_pity': len(r) - 1 - int(five[-1]) if len(five) else len(r),
+            'four_star_pity': len(r) - 1 - int(four_or_more[-1]) if len(four_or_more) else len(r),
+            # distances between consecutive 5*, the first one counts from the start of the banner
+            'average_five_star_pity': float(np.diff(five, prepend=-1).mean()) if len(five) else None,
+        })
+    return stats
+
+class _RateBudget:
+    """Spaces out requests"""
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.next = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def wait(self) -> None:
+        async with self.lock:
+            delay = self.next - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next = time.monotonic() + self.interval
+
+class _Cookie:
+    """Usage and health of a single hoyolab cookie"""
+    def __init__(self, cookie: dict[str, Any], interval: float) -> None:
+        self.cookie = cookie
+        self.budget = _RateBudget(interval)
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.cooldown = 0.0
+    
+    def __repr__(self) -> str:
+        return (f"<Cookie ltuid={self.cookie.get('ltuid')} requests={self.requests} errors={self.errors} "
+                f"in_flight={self.in_flight} cooldown={max(self.cooldown - time.time(), 0):.0f}s>")
+
+class _CookiePool:
+    """Hoyolab cookies shared between interactive commands and background jobs
+    
+    Every call uses the least loaded healthy cookie. Ratelimited cookies are taken out 
+    of rotation until the daily reset and cookies which keep failing cool down for a while.
+    Background calls wait until no interactive calls are in flight and can't use
+    the last reserve requests of a cookie's daily limit.
+    """
+    def __init__(
+        self,
+        cookies: list[dict[str, Any]],
+        interval: float = 1,
+        max_failures: int = 5,
+        cooldown: float = 600,
+        daily_limit: int = 30,
+        reserve: int = 10,
+    ) -> None:
+        self.cookies = [_Cookie(cookie, interval) for cookie in cookies]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.daily_limit = daily_limit
+        self.reserve = reserve
+        self.day = datetime.utcnow().date()
+        self.interactive = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+    
+    def __len__(self) -> int:
+        return len(self.cookies)
+    
+    def healthy(self) -> list[_Cookie]:
+        """Returns the cookies that are currently in rotation"""
+        today = datetime.utcnow().date()
+        if today != self.day:
+            self.day = today
+            for cookie in self.cookies:
+                cookie.requests = 0
+        
+        now = time.time()
+        return [cookie for cookie in self.cookies if cookie.cooldown <= now]
+    
+    def _pick(self, background: bool = False) -> _Cookie:
+        healthy = self.healthy()
+        if background:
+            # the rest of the day's requests are kept for commands
+            healthy = [cookie for cookie in healthy if cookie.requests < self.daily_limit - self.reserve]
+        if not healthy:
+            raise gs.TooManyRequests("All cookies have hit their request limit, try again later.")
+        return min(healthy, key=lambda cookie: (cookie.in_flight, cookie.requests))
+    
+    async def run(self, func: Callable[..., Awaitable[T]], *args: Any, background: bool = False, **kwargs: Any) -> T:
+        """Calls a hoyolab client method with a cookie from the pool
+        
+        Calls are retried with other cookies until there are no healthy ones left.
+        """
+        if background:
+            await self._idle.wait()
+        else:
+            self.interactive += 1
+            self._idle.clear()
+        
+        try:
+            while True:
+                cookie = self._pick(background)
+                try:
+                    return await self._call(cookie, func, *args, **kwargs)
+                except gs.TooManyRequests:
+                    cookie.errors += 1
+                    reset = datetime.combine(self.day + timedelta(days=1), datetime.min.time(), timezone.utc)
+                    cookie.cooldown = reset.timestamp()
+                except gs.NotLoggedIn:
+                    cookie.errors += 1
+                    cookie.cooldown = time.time() + self.cooldown
+        finally:
+            if not background:
+                self.interactive -= 1
+                if self.interactive == 0:
+                    self._idle.set()
+    
+    async def _call(self, cookie: _Cookie, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        cookie.in_flight += 1
+        try:
+            await cookie.budget.wait()
+            cookie.requests += 1
+            result = await func(*args, cookie=cookie.cookie, **kwargs)
+        except gs.GenshinStatsException:
+            # either caused by the requested user or handled by the pool
+            raise
+        except Exception:
+            cookie.errors += 1
+            cookie.failures += 1
+            if cookie.failures >= self.max_failures:
+                cookie.failures = 0
+                cookie.cooldown = time.time() + self.cooldown
+            raise
+        else:
+            cookie.failures = 0
+            return result
+        finally:
+            cookie.in_flight -= 1
+
 class GenshinImpact(CCog):
     """Show info about Genshin Impact users using mihoyo's api"""
     icon_cache: dict[int, str] = {}
+    wish_stats_cache: LRUCache[int, list[dict[str, Any]]] = LRUCache(256)
+    # registered uids used in the past day, their cache is kept warm in the background
+    active_uids: TTLCache[int, float] = TTLCache(1024, 24 * 3600)
+    # random uids whose stats are already cached, refilled in the background
+    random_pool: deque[int] = deque()
+    random_pool_size: int = 10
+    hoyolab: HoyolabClient
+    # the latest spiral abyss season seen on any user
+    abyss_season: Optional[int] = None
+    
+    def __init__(self, bot) -> None:
+        self._warm_budget = _RateBudget(5)
     
     async def init(self):
         with open(self.config['cookie_file']) as file:
-            cookies = json.load(file)
-        gs.set_cookies(*cookies)
-        self.cache = TTLCache(1024, 3600)
-        gs.install_cache(self.cache)
+            self.cookies = _CookiePool(json.load(file))
         
         await self.bot.wait_until_ready()
+        # the bot's session only exists once it has started
+        self.hoyolab = HoyolabClient(self.bot.session)
         self.db = self.bot.db.genshin
+        # (ttl, stale) in seconds, stale data is served while it's being refreshed
+        self.cache = MongoCache(self.db.cache, {
+            'user_stats': (3600, 6 * 3600),
+            'characters': (3600, 6 * 3600),
+            'spiral_abyss': (3600, 6 * 3600),
+            'spiral_abyss_previous': (16 * 24 * 3600, 0),
+            'langs': (7 * 24 * 3600, 7 * 24 * 3600),
+        }, maxsize=4096)
+        await self.cache.init()
+        
+        await self.db.wishes.create_index([('uid', 1), ('banner_type', 1), ('id', -1)])
+        await self.db.wishes.create_index([('uid', 1), ('time', -1), ('id', -1)])
+        # snapshots are keyed by uid, users can have several documents with the same one
+        await self.db.snapshots.create_index('updated')
+        await self.db.snapshots.create_index([('achievements', -1), ('_id', 1)])
+        await self.db.snapshots.create_index([('exploration', -1), ('_id', 1)])
+        await self.db.snapshots.create_index([('abyss_season', -1), ('abyss_stars', -1), ('_id', 1)])
+        latest = await self.db.snapshots.find_one({'abyss_season': {'$exists': True}}, sort=[('abyss_season', -1)])
+        if latest is not None:
+            self.abyss_season = latest['abyss_season']
+        
+        self.warm_cache.start()
+        self.fill_random_pool.start()
+    
+    async def close(self) -> None:
+        self.warm_cache.cancel()
+        self.fill_random_pool.cancel()
+        if hasattr(self, 'hoyolab'):
+            await self.hoyolab.close()
+    
+    async def _fetch_user_stats(self, uid: int, background: bool = False) -> dict[str, Any]:
+        data = await self.cookies.run(self.hoyolab.get_user_stats, uid, background=background)
+        await self._save_snapshot(uid, stats=data)
+        return data
+    
+    async def get_user_stats(self, uid: int, background: bool = False) -> dict[str, Any]:
+        return await self.cache.get('user_stats', (uid,), lambda: self._fetch_user_stats(uid, background))
+    
+    async def _fetch_characters(self, uid: int, lang: str = 'en-us', background: bool = False) -> list[dict[str, Any]]:
+        # the character ids are required so reuse cached stats instead of requesting them again
+        stats = await self.get_user_stats(uid, background)
+        ids = [i['id'] for i in stats['characters']]
+        return await self.cookies.run(self.hoyolab.get_characters, uid, ids, lang=lang, background=background)
+    
+    async def get_characters(self, uid: int, lang: str = 'en-us') -> list[dict[str, Any]]:
+        return await self.cache.get('characters', (uid, lang), lambda: self._fetch_characters(uid, lang))
+    
+    async def _fetch_spiral_abyss(self, uid: int, previous: bool = False, background: bool = False) -> dict[str, Any]:
+        data = await self.cookies.run(self.hoyolab.get_spiral_abyss, uid, previous, background=background)
+        if not previous:
+            await self._save_snapshot(uid, abyss=data)
+        return data
+    
+    async def get_spiral_abyss(self, uid: int, previous: bool = False) -> dict[str, Any]:
+        if previous:
+            return (await self.get_spiral_abyss_seasons(uid))[1]
+        return await self.cache.get('spiral_abyss', (uid,), lambda: self._fetch_spiral_abyss(uid))
+    
+    async def get_spiral_abyss_seasons(self, uid: int) -> tuple[dict[str, Any], dict[str, Any]]:
+        """Returns the current and the previous season of a user, requested concurrently
+        
+        Past seasons never change so they're keyed by the season that followed them,
+        the latest season seen on any user is used as the key before the current one is known.
+        """
+        fetch_current = lambda: self._fetch_spiral_abyss(uid)
+        fetch_previous = lambda: self._fetch_spiral_abyss(uid, True)
+        if self.abyss_season is None:
+            current = await self.cache.get('spiral_abyss', (uid,), fetch_current)
+            previous = await self.cache.get('spiral_abyss_previous', (uid, current['season']), fetch_previous)
+        else:
+            current, previous = await asyncio.gather(
+                self.cache.get('spiral_abyss', (uid,), fetch_current),
+                self.cache.get('spiral_abyss_previous', (uid, self.abyss_season), fetch_previous),
+            )
+        self.abyss_season = max(self.abyss_season or 0, current['season'])
+        
+        if previous['season'] != current['season'] - 1:
+            # the season was reset since one of them was cached
+            current = await self.cache.refresh('spiral_abyss', (uid,), fetch_current)
+            if previous['season'] != current['season'] - 1:
+                previous = await self.cache.refresh('spiral_abyss_previous', (uid, current['season']), fetch_previous)
+        return current, previous
+    
+    async def get_langs(self) -> dict[str, str]:
+        return await self.cache.get('langs', (), self.hoyolab.get_langs)
+    
+    async def _save_snapshot(self, uid: int, stats: dict[str, Any] = None, abyss: dict[str, Any] = None) -> None:
+        """Persists the values leaderboards are computed from"""
+        now = datetime.utcnow()
+        update: dict[str, Any] = {'updated': now}
+        if stats is not None:
+            explored = [i['explored'] for i in stats['explorations']]
+            update.update({
+                'achievements': stats['stats']['achievements'],
+                'exploration': round(sum(explored) / len(explored), 1) if explored else 0,
+            })
+        if abyss is not None:
+            update.update({
+                'abyss_season': abyss['season'],
+                'abyss_stars': abyss['stats']['total_stars'],
+            })
+        await self.db.snapshots.update_one({'_id': uid}, {'$set': update}, upsert=True)
+    
+    async def refresh_snapshots(self, limit: int = 100) -> int:
+        """Refreshes the snapshots which were updated the longest time ago, returns the amount refreshed
+        
+        Crawled users get an empty snapshot that's older than any other so they're refreshed first.
+        """
+        refreshed = 0
+        async for snapshot in self.db.snapshots.find({}, {'_id': 1}).sort('updated', 1).limit(limit):
+            uid = snapshot['_id']
+            try:
+                await self.cache.refresh('user_stats', (uid,), lambda: self._fetch_user_stats(uid, background=True))
+                await self.cache.refresh('spiral_abyss', (uid,), lambda: self._fetch_spiral_abyss(uid, background=True))
+            except gs.TooManyRequests:
+                break
+            except gs.GenshinStatsException as e:
+                self.logger.debug(f"Could not refresh the snapshot of {uid}: {e}")
+                # private users would otherwise always be picked first
+                await self.db.snapshots.update_one({'_id': uid}, {'$set': {'updated': datetime.utcnow()}})
+                continue
+            refreshed += 1
+        return refreshed
+    
+    async def leaderboard_page(self, category: str, limit: int = 10, skip: int = 0) -> list[dict[str, Any]]:
+        """Returns a page of a cross-user leaderboard, served from the snapshot indexes"""
+        field = leaderboards[category][0]
+        match: dict[str, Any] = {field: {'$exists': True}}
+        if category == 'abyss':
+            # stars reset every season so only the latest one is ranked
+            latest = await self.db.snapshots.find_one({'abyss_season': {'$exists': True}}, sort=[('abyss_season', -1)])
+            if latest is None:
+                return []
+            match = {'abyss_season': latest['abyss_season']}
+        
+        return await self.db.snapshots.aggregate([
+            {'$match': match},
+            {'$sort': {field: -1, '_id': 1}},
+            {'$skip': skip},
+            {'$limit': limit},
+            {'$project': {'_id': 0, 'uid': '$_id', 'nickname': 1, 'value': '$' + field}},
+        ]).to_list(None)
+    
+    async def _warm_uid(self, uid: int, margin: float) -> None:
+        """Refreshes every cached response of a uid which would expire within margin seconds"""
+        targets = [
+            ('user_stats', (uid,), lambda: self._fetch_user_stats(uid, background=True)),
+            ('characters', (uid, 'en-us'), lambda: self._fetch_characters(uid, background=True)),
+            ('spiral_abyss', (uid,), lambda: self._fetch_spiral_abyss(uid, background=True)),
+        ]
+        for namespace, key, fetch in targets:
+            if await self.cache.fresh(namespace, key, margin):
+                continue
+            
+            await self._warm_budget.wait()
+            await self.cache.refresh(namespace, key, fetch)
+    
+    @tasks.loop(minutes=10)
+    async def warm_cache(self):
+        """Keeps the cache of recently active registered users warm
+        
+        Runs at a low priority, every request waits until no interactive requests are in flight
+        and warming as a whole makes at most one request per 5 seconds.
+        """
+        for uid in list(self.active_uids):
+            try:
+                await self._warm_uid(uid, self.warm_cache.minutes * 60)
+            except gs.TooManyRequests:
+                self.logger.debug("Stopped warming the cache because of ratelimits")
+                return
+            except gs.GenshinStatsException as e:
+                self.logger.debug(f"Could not warm the cache of {uid}: {e}")
+    
+    @tasks.loop(minutes=1)
+    async def fill_random_pool(self):
+        """Tops up the pool of random users with uids whose stats were fetched successfully
+        
+        Shares the background budget with cache warming so it never competes with interactive commands.
+        Uids whose stats expired since they were added are dropped so the pool never serves a cold uid.
+        """
+        for uid in list(self.random_pool):
+            if not await self.cache.fresh('user_stats', (uid,)) and uid in self.random_pool:
+                self.random_pool.remove(uid)
+        
+        missing = self.random_pool_size - len(self.random_pool)
+        if missing <= 0:
+            return
+        
+        async for user in self.db.users.aggregate([{"$sample": {"size": missing}}]):
+            # $sample may return uids which are already pooled
+            if user['uid'] in self.random_pool:
+                continue
+            if not await self.cache.fresh('user_stats', (user['uid'],)):
+                await self._warm_budget.wait()
+            try:
+                await self.get_user_stats(user['uid'], background=True)
+            except gs.TooManyRequests:
+                return
+            except gs.GenshinStatsException:
+                # private or nonexistent accounts
+                continue
+            self.random_pool.append(user['uid'])
     
     def _element_emoji(self, element: str) -> discord.Emoji:
         g = self.bot.get_guild(570841314200125460) or self.bot.guilds[0]
@@ -81,54 +462,85 @@ class GenshinImpact(CCog):
             else:
                 raise commands.BadArgument(f"User does not have a uid set")
         
+        self.active_uids[data['uid']] = time.time()
         return data['uid']
 
-    async def update_users_cache(self):
-        """Updates the user cache in the database"""
-        await self.bot.wait_until_ready()
-        
-        already_fetched: set[int] = set()
-        already_fetched_hoyolab: set[int] = set()
-        async for i in self.db.users.find({'hoyolab_uid': {'$exists': True}}):
-            already_fetched.add(i['uid'])
-            already_fetched_hoyolab.add(i['hoyolab_uid'])
-        
-        users = await to_thread(gs.get_recommended_users)
-        for i, user in enumerate(users):
-            if i % 25 == 0:
-                # swap cookies for efficency
-                gs.genshinstats.cookies.append(gs.genshinstats.cookies.pop(0))
-            hoyolab_uid = int(user['user']['uid'])
-            print(hoyolab_uid)
-            if hoyolab_uid in already_fetched_hoyolab:
-                continue
-            await asyncio.sleep(1) # avoid ratelimit
-            card = await to_thread(gs.get_record_card, hoyolab_uid)
-            if card is None:
-                continue
-            uid = int(card['game_role_id'])
-            if uid in already_fetched:
-                continue
+    async def _enqueue_recommended_users(self) -> int:
+        """Adds recommended users which haven't been crawled yet to the crawl queue"""
+        users = await self.hoyolab.get_recommended_users()
+        queued = 0
+        for chunk in grouper((int(user['user']['uid']) for user in users), 500):
+            known = {
+                i['hoyolab_uid'] async for i in 
+                self.db.users.find({'hoyolab_uid': {'$in': chunk}}, {'hoyolab_uid': 1})
+            }
+            operations = [
+                UpdateOne({'_id': hoyolab_uid}, {'$setOnInsert': {'state': 'pending'}}, upsert=True)
+                for hoyolab_uid in chunk if hoyolab_uid not in known
+            ]
+            if operations:
+                result = await self.db.crawl_queue.bulk_write(operations, ordered=False)
+                queued += result.upserted_count
+        return queued
+    
+    async def _crawl_worker(self) -> None:
+        """Crawls queued hoyolab users until the queue is empty or every cookie is ratelimited"""
+        while True:
+            job = await self.db.crawl_queue.find_one_and_update(
+                {'state': 'pending'}, {'$set': {'state': 'claimed'}}
+            )
+            if job is None:
+                return
             
-            await self.db.users.insert_one(
-                {'uid': uid, 'hoyolab_uid': hoyolab_uid}
+            hoyolab_uid = job['_id']
+            try:
+                card = await self.cookies.run(self.hoyolab.get_record_card, hoyolab_uid, background=True)
+            except gs.TooManyRequests:
+                await self.db.crawl_queue.update_one({'_id': hoyolab_uid}, {'$set': {'state': 'pending'}})
+                return
+            except gs.GenshinStatsException as e:
+                self.logger.debug(f"Could not crawl {hoyolab_uid}: {e}")
+                card = None
+            
+            if card is not None:
+                uid = int(card['game_role_id'])
+                await self.db.users.update_one(
+                    {'uid': uid},
+                    {'$setOnInsert': {'hoyolab_uid': hoyolab_uid}, '$set': {'nickname': card['nickname']}},
+                    upsert=True
+                )
+                await self.db.snapshots.update_one(
+                    {'_id': uid},
+                    {'$setOnInsert': {'updated': datetime.utcfromtimestamp(0)}, '$set': {'nickname': card['nickname']}},
+                    upsert=True
+                )
+            await self.db.crawl_queue.update_one(
+                {'_id': hoyolab_uid}, {'$set': {'state': 'done', 'checked': datetime.utcnow()}}
             )
     
-    @commands.group(invoke_without_command=True, aliases=['gs', 'gi', 'ys'])
-    @commands.cooldown(5, 60, commands.BucketType.user)
-    async def genshin(self, ctx: commands.Context, user: Union[discord.User, int] = None):
-        """Shows info about a genshin player"""
-        uid = await self._user_uid(ctx, user)
+    async def update_users_cache(self, workers_per_cookie: int = 2):
+        """Crawls recommended hoyolab users into the database and refreshes the stalest leaderboard snapshots
         
-        await ctx.trigger_typing()
-        try:
-            data = await to_thread(gs.get_user_stats, uid)
-        except gs.GenshinStatsException as e:
-            await ctx.send(e.msg)
-            return
-
-        pages = []
+        Workers share the cookie pool with interactive commands and wait while their requests are in flight.
+        Progress is kept in the crawl queue so an interrupted crawl continues where it left off.
+        """
+        await self.bot.wait_until_ready()
+        await self.db.users.create_index('uid')
+        await self.db.users.create_index('hoyolab_uid', sparse=True)
+        await self.db.crawl_queue.create_index('state')
+        # jobs claimed by a crawl that was interrupted
+        await self.db.crawl_queue.update_many({'state': 'claimed'}, {'$set': {'state': 'pending'}})
+        
+        queued = await self._enqueue_recommended_users()
+        self.logger.info(f"Queued {queued} new hoyolab users for crawling")
         
+        await asyncio.gather(*(self._crawl_worker() for _ in range(workers_per_cookie * len(self.cookies))))
+        
+        refreshed = await self.refresh_snapshots()
+        self.logger.info(f"Refreshed {refreshed} leaderboard snapshots")
+    
+    def _genshin_pages(self, uid: int, data: dict[str, Any]) -> Iterator[discord.Embed]:
+        """Lazily creates the embeds for basic user stats."""
         stats_embed = discord.Embed(
             colour=0xffffff,
             title=f"Info about {uid}",
@@ -142,7 +554,7 @@ class GenshinImpact(CCog):
                 name=field.replace('_', ' '),
                 value=value
             )
-        pages.append(stats_embed)
+        yield stats_embed
         
         exploration_embed = discord.Embed(
             colour=0xffffff,
@@ -168,7 +580,7 @@ class GenshinImpact(CCog):
                       f"Unlocked styles: {', '.join(i['name'] for i in data['teapots'])}"
             )
         
-        pages.append(exploration_embed)
+        yield exploration_embed
         
         character_embed = discord.Embed(
             colour=0xffffff,
@@ -186,15 +598,32 @@ class GenshinImpact(CCog):
                     name=f"{char['name']}",
                     value=f"{'★'*char['rarity']} {self._element_emoji(char['element'])}\nlvl {char['level']}, friendship {char['friendship']}"
                 )
-            pages.append(embed)
+            yield embed
+    
+    @commands.group(invoke_without_command=True, aliases=['gs', 'gi', 'ys'])
+    @commands.cooldown(5, 60, commands.BucketType.user)
+    async def genshin(self, ctx: commands.Context, user: Union[discord.User, int] = None):
+        """Shows info about a genshin player"""
+        uid = await self._user_uid(ctx, user)
         
+        await ctx.trigger_typing()
+        try:
+            data = await self.get_user_stats(uid)
+        except gs.GenshinStatsException as e:
+            await ctx.send(e.msg)
+            return
         
-        await send_pages(ctx, ctx, pages)
+        await send_pages(ctx, ctx, self._genshin_pages(uid, data))
     
     @genshin.command('random')
     @commands.cooldown(5, 60, commands.BucketType.user)
     async def genshin_random(self, ctx: commands.Context):
         """Shows stats for a random user"""
+        while self.random_pool:
+            uid = self.random_pool.popleft()
+            if await self.cache.fresh('user_stats', (uid,)):
+                return await self.genshin(ctx, uid)
+        
         users = await self.db.users.aggregate([
             {"$sample": {"size": 1}}
         ]).next()
@@ -206,13 +635,13 @@ class GenshinImpact(CCog):
         """Shows info about a genshin player's characters"""
         uid = await self._user_uid(ctx, user)
         
-        langs = gs.get_langs()
+        langs = await self.get_langs()
         if lang not in langs:
             raise commands.UserInputError("Invalid lang, must be one of: " + ', '.join(langs.keys()))
         
         await ctx.trigger_typing()
         try:
-            data = await to_thread(gs.get_characters, uid, lang=lang)
+            data = await self.get_characters(uid, lang)
         except gs.GenshinStatsException as e:
             await ctx.send(e.msg)
             return
@@ -220,7 +649,7 @@ class GenshinImpact(CCog):
         for char in data:
             self.icon_cache[char['weapon']['name']] = char['weapon']['icon']
         
-        embeds = [
+        embeds = (
             discord.Embed(
                 colour=_item_color(char['rarity']),
                 title=char['name'],
@@ -244,40 +673,37 @@ class GenshinImpact(CCog):
                 icon_url=GENSHIN_LOGO
             )
             for char in data
-        ]
+        )
         await send_pages(ctx, ctx, embeds)
     
-    async def _genshin_abyss(self, uid: int, previous: bool) -> list[discord.Embed]:
+    def _genshin_abyss(self, uid: int, data: dict[str, Any]) -> Iterator[discord.Embed]:
         # sourcery no-metrics
-        """Gets the embeds for spiral abyss history for a specific season."""
-        data = await to_thread(gs.get_spiral_abyss, uid, previous)
+        """Lazily creates the embeds for spiral abyss history of a specific season."""
         if data['stats']['total_battles'] == 0:
-            return []
+            return
         
         star = self._element_emoji('abyss_star')
-        embeds = [
-            discord.Embed(
-                colour=0xffffff,
-                title=f"Spiral abyss info of {uid}",
-                description="Overall spiral abyss stats"
-            ).add_field(
-                name="Stats",
-                value=f"Max floor: {data['stats']['max_floor']} Total stars: {data['stats']['total_stars']}\n"
-                      f"Total battles: {data['stats']['total_battles']} Total wins: {data['stats']['total_wins']}",
-                inline=False
-            ).add_field(
-                name="Character ranks",
-                value="\n".join(f"**{k.replace('_',' ')}**: " + ', '.join(f"{i['name']} ({i['value']})" for i in v[:4]) for k,v in data['character_ranks'].items() if v) or "avalible only for floor 9 or above",
-                inline=False
-            ).set_author(
-                name=f"Season {data['season']} ({data['season_start_time'].replace('-', '/')} - {data['season_end_time'].replace('-', '/')})\n"
-            ).set_footer(
-                text="Powered by genshinstats",
-                icon_url=GENSHIN_LOGO
-            ).set_image(
-                url=abyss_banners[0]
-            )
-        ]
+        yield discord.Embed(
+            colour=0xffffff,
+            title=f"Spiral abyss info of {uid}",
+            description="Overall spiral abyss stats"
+        ).add_field(
+            name="Stats",
+            value=f"Max floor: {data['stats']['max_floor']} Total stars: {data['stats']['total_stars']}\n"
+                  f"Total battles: {data['stats']['total_battles']} Total wins: {data['stats']['total_wins']}",
+            inline=False
+        ).add_field(
+            name="Character ranks",
+            value="\n".join(f"**{k.replace('_',' ')}**: " + ', '.join(f"{i['name']} ({i['value']})" for i in v[:4]) for k,v in data['character_ranks'].items() if v) or "avalible only for floor 9 or above",
+            inline=False
+        ).set_author(
+            name=f"Season {data['season']} ({data['season_start_time'].replace('-', '/')} - {data['season_end_time'].replace('-', '/')})\n"
+        ).set_footer(
+            text="Powered by genshinstats",
+            icon_url=GENSHIN_LOGO
+        ).set_image(
+            url=abyss_banners[0]
+        )
         for floor in data['floors']:
             embed = discord.Embed(
                 colour=0xffffff,
@@ -301,8 +727,7 @@ class GenshinImpact(CCog):
                     )
                     if battle['half'] == 2:
                         embed.add_field(name='\u200b', value='\u200b')
-            embeds.append(embed)
-        return embeds
+            yield embed
         
     @genshin.command('abyss', aliases=['spiral'])
     @commands.cooldown(5, 60, commands.BucketType.user)
@@ -311,17 +736,16 @@ class GenshinImpact(CCog):
         uid = await self._user_uid(ctx, user)
 
         await ctx.trigger_typing()
-        # this should've been a generator but it's too much of a pain
-        embeds = []
         try:
-            embeds += await self._genshin_abyss(uid, False)
-            embeds += await self._genshin_abyss(uid, True)
+            seasons = await self.get_spiral_abyss_seasons(uid)
         except gs.GenshinStatsException as e:
             await ctx.send(e.msg)
             return
-        if not embeds:
+        if all(data['stats']['total_battles'] == 0 for data in seasons):
             await ctx.send("Player hasn't done any spiral abyss in the past month")
             return
+        
+        embeds = itertools.chain.from_iterable(self._genshin_abyss(uid, data) for data in seasons)
 
         await send_pages(ctx, ctx, embeds)
     
@@ -377,13 +801,67 @@ class GenshinImpact(CCog):
             )
         return embed
     
-    @genshin.command('wishes', aliases=['wish', 'wishHistory'])
-    async def genshin_wish_history(self, ctx: commands.Context):
-        """Shows your wish history, to view it you must provide your authkey.
+    async def sync_wish_history(self, uid: int, authkey: str) -> int:
+        """Stores pulls newer than the last stored pull of every banner, returns the amount of new pulls
         
-        For instructions as to how to get the authkey refer to the "auto import" section in https://paimon.moe/wish.
-        Sharing this authkey is safe but if you do not feel comfortable sharing it you should run this command in dms.
+        Pulls are yielded newest first so only the pages up to the last stored pull are requested.
         """
+        async def fetch_new(banner_type: int, last_id: int) -> list[dict[str, Any]]:
+            pulls = []
+            async for pull in self.hoyolab.get_wish_history(banner_type, authkey):
+                if pull['id'] <= last_id:
+                    break
+                pulls.append(pull)
+            return pulls
+        
+        async def sync_banner(banner_type: int) -> int:
+            # the character event banner also returns pulls from its second banner
+            types = [banner_type, *(i for i, pity in pity_banners.items() if pity == banner_type and i != banner_type)]
+            last = await self.db.wishes.find_one(
+                {'uid': uid, 'banner_type': {'$in': types}}, sort=[('id', -1)]
+            )
+            pulls = await fetch_new(banner_type, last['id'] if last else 0)
+            if not pulls:
+                return 0
+            # upserts so concurrent syncs of the same user don't collide
+            result = await self.db.wishes.bulk_write([
+                UpdateOne({'_id': pull['id']}, {'$setOnInsert': pull}, upsert=True)
+                for pull in pulls
+            ], ordered=False)
+            return result.upserted_count
+        
+        banner_types = await self.hoyolab.get_banner_types(authkey)
+        new = sum(await asyncio.gather(*(sync_banner(i) for i in banner_types)))
+        if new:
+            self.wish_stats_cache.pop(uid, None)
+        return new
+    
+    async def get_wish_stats(self, uid: int) -> list[dict[str, Any]]:
+        """Returns wish statistics of every banner, cached until new pulls are synced"""
+        if uid in self.wish_stats_cache:
+            return self.wish_stats_cache[uid]
+        
+        cursor = self.db.wishes.find({'uid': uid}, {'_id': 0, 'rarity': 1, 'banner_type': 1}).sort([('time', 1), ('id', 1)])
+        pulls = await cursor.to_list(None)
+        rarity = np.fromiter((i['rarity'] for i in pulls), dtype=np.int8, count=len(pulls))
+        banner = np.fromiter((pity_banners.get(i['banner_type'], i['banner_type']) for i in pulls), dtype=np.int16, count=len(pulls))
+        
+        stats = self.wish_stats_cache[uid] = _wish_stats(rarity, banner)
+        return stats
+    
+    async def _grouped_wish_history(self, uid: int) -> AsyncIterator[list[dict[str, Any]]]:
+        """Yields stored pulls newest first, grouped by the time they were made"""
+        group: list[dict[str, Any]] = []
+        async for pull in self.db.wishes.find({'uid': uid}).sort([('time', -1), ('id', -1)]):
+            if group and pull['time'] != group[0]['time']:
+                yield group
+                group = []
+            group.append(pull)
+        if group:
+            yield group
+    
+    async def _wish_login(self, ctx: commands.Context) -> Optional[tuple[int, str]]:
+        """Gets the uid and a valid authkey of the author, asks for a new authkey in dms if needed"""
         data = await self.db.users.find_one({
             'discord_id': ctx.author.id, 
             'authkey': {'$exists': True}
@@ -394,14 +872,14 @@ class GenshinImpact(CCog):
             message = await discord_input(ctx.bot, ctx.author, ctx.author)
             if message is None:
                 await ctx.author.send("Timed out!")
-                return
+                return None
             authkey = message.content.strip()
         else:
             authkey = data['authkey']
 
         while True:
             try:
-                uid = await to_thread(gs.get_uid_from_authkey, authkey)
+                uid = await self.hoyolab.get_uid_from_authkey(authkey)
             except gs.InvalidAuthkey:
                 await ctx.author.send("That authkey is invalid, it must either be a url with the authkey or the authkey itself.")
             except gs.AuthkeyTimeout:
@@ -421,16 +899,34 @@ class GenshinImpact(CCog):
             message = await discord_input(ctx.bot, ctx.author, ctx.author)
             if message is None:
                 await ctx.author.send("Timed out!")
-                return
+                return None
             authkey = message.content.strip()
 
+        return uid, authkey
+    
+    @genshin.command('wishes', aliases=['wish', 'wishHistory'])
+    async def genshin_wish_history(self, ctx: commands.Context):
+        """Shows your wish history, to view it you must provide your authkey.
+        
+        For instructions as to how to get the authkey refer to the "auto import" section in https://paimon.moe/wish.
+        Sharing this authkey is safe but if you do not feel comfortable sharing it you should run this command in dms.
+        """
+        login = await self._wish_login(ctx)
+        if login is None:
+            return
+        uid, authkey = login
 
-        def embeds():
+        await ctx.trigger_typing()
+        try:
+            await self.sync_wish_history(uid, authkey)
+        except gs.AuthkeyError as e:
+            await ctx.send(e.msg)
+            return
+
+        async def embeds():
             """Helper function to make a multiline generator"""
             single_pulls = []
-            for time, g in groupby(gs.get_wish_history(authkey=authkey), key=lambda x: x['time']):
-                pulls = list(g)
-
+            async for pulls in self._grouped_wish_history(uid):
                 if len(pulls) == 1:
                     single_pulls.append(pulls[0])
 
@@ -441,13 +937,58 @@ class GenshinImpact(CCog):
                 if len(pulls) == 10:
                     yield self.create_10pull_embed(pulls)
         
-        await send_pages(ctx, ctx, embeds(), asyncify=True)
+        await send_pages(ctx, ctx, embeds())
+    
+    @genshin.command('wishstats', aliases=['pity', 'wishStats'])
+    async def genshin_wish_stats(self, ctx: commands.Context):
+        """Shows your pity, 4★ and 5★ rates and a summary of every banner.
+        
+        Uses the same authkey as the wishes command.
+        """
+        login = await self._wish_login(ctx)
+        if login is None:
+            return
+        uid, authkey = login
+        
+        await ctx.trigger_typing()
+        try:
+            await self.sync_wish_history(uid, authkey)
+        except gs.AuthkeyError as e:
+            await ctx.send(e.msg)
+            return
+        
+        stats = await self.get_wish_stats(uid)
+        if not stats:
+            await ctx.send("You have never made a wish")
+            return
+        
+        embed = discord.Embed(
+            colour=_item_color(5),
+            title=f"Wish stats of {uid}",
+            description=f"Total pulls: **{sum(i['total'] for i in stats)}**"
+        ).set_footer(
+            text="Powered by genshinstats",
+            icon_url=GENSHIN_LOGO
+        )
+        for banner in stats:
+            average = banner['average_five_star_pity']
+            embed.add_field(
+                name=banner_names.get(banner['banner_type'], str(banner['banner_type'])),
+                value=f"Pulls: {banner['total']}\n"
+                      f"5★: {banner['five_stars']} ({banner['five_star_rate']:.2%}) "
+                      f"4★: {banner['four_stars']} ({banner['four_star_rate']:.2%})\n"
+                      f"5★ pity: **{banner['five_star_pity']}**/{max_pity.get(banner['banner_type'], 90)} "
+                      f"4★ pity: **{banner['four_star_pity']}**/10\n"
+                      f"Average 5★ pity: {f'{average:.1f}' if average is not None else 'none yet'}",
+                inline=False
+            )
+        await ctx.send(embed=embed)
     
     @genshin.command('setuid', aliases=['login'])
     async def genshin_setuid(self, ctx: commands.Context, uid: int):
         """Sets a uid to your account letting the bot remember you when you request more data"""
         try:
-            await to_thread(gs.get_user_stats, uid)
+            await self.get_user_stats(uid)
         except gs.GenshinStatsException as e:
             await ctx.send(e.msg)
             return
@@ -458,6 +999,56 @@ class GenshinImpact(CCog):
             upsert=True
         )
         await ctx.send(f"Updated your uid to {uid}")
+    
+    @genshin.command('leaderboard', aliases=['lb', 'top'])
+    @commands.cooldown(5, 60, commands.BucketType.user)
+    async def genshin_leaderboard(self, ctx: commands.Context, category: str = 'achievements'):
+        """Shows a leaderboard of every known player
+        
+        Category can be achievements, abyss or exploration.
+        Players are updated whenever someone requests their stats and periodically by the crawler.
+        """
+        category = category.lower()
+        if category not in leaderboards:
+            raise commands.UserInputError("Invalid category, must be one of: " + ', '.join(leaderboards))
+        _, title, value = leaderboards[category]
+        
+        if not await self.leaderboard_page(category, 1):
+            await ctx.send("There are no players on this leaderboard yet")
+            return
+        
+        async def pages():
+            for skip in itertools.count(0, 10):
+                users = await self.leaderboard_page(category, 10, skip)
+                if not users:
+                    return
+                
+                embed = discord.Embed(
+                    colour=0xffffff,
+                    title=f"{title} leaderboard",
+                    description="Leaderboard of every player known to the bot"
+                ).set_footer(
+                    text="Powered by genshinstats",
+                    icon_url=GENSHIN_LOGO
+                )
+                for i, user in enumerate(users, skip + 1):
+                    name = f"{user['nickname']} ({user['uid']})" if user.get('nickname') else user['uid']
+                    embed.add_field(
+                        name=f"{i}. {name}",
+                        value=value.format(user['value']),
+                        inline=False
+                    )
+                yield embed
+        
+        await send_pages(ctx, ctx, pages())
+    
+    @genshin.command('cachestats', hidden=True)
+    @commands.is_owner()
+    async def genshin_cachestats(self, ctx: commands.Context):
+        """Shows hits and misses of the genshin cache and usage of the cookies"""
+        stats = '\n'.join(f"{k}: {v}" for k, v in sorted(self.cache.stats.items()))
+        cookies = '\n'.join(map(repr, self.cookies.cookies))
+        await ctx.send(wrap((stats or "no requests yet") + '\n\n' + cookies))
         
 
 def setup(bot):
@@ -3,13 +3,15 @@ import asyncio
 import random
 from collections import Counter
 from datetime import datetime
-from typing import Union
+from typing import Any, Optional, Union
 from utils.types import GuildContext
 
 import discord
 import humanize
+from cachetools import TTLCache
 from discord.ext import commands
-from utils import CCog, get_role, get_webhook, guild_check, humandate
+from pymongo import ReturnDocument
+from utils import CCog, IncrementBuffer, WordMatcher, get_role, get_user_names, get_webhook, guild_check, humandate
 
 
 class Misc(CCog):
@@ -40,17 +42,49 @@ class Misc(CCog):
         await vc.disconnect()
         self.logger.debug(f'{ctx.author} played a soundeffect to {target}.')
     
-    @commands.command('antitor', aliases=['iknowwhatyoudownload', 'torrent', 'peer']) 
-    @commands.cooldown(rate=1000, per=24*60*60*60, type=lambda msg: 0) # global limit 1000/day
-    @commands.cooldown(rate=5, per=60, type=commands.BucketType.user)
-    async def antitor(self, ctx: commands.Context, ip: str, amount: int = 10):
-        """Shows the torrent history of an ip. Powered by iknowwhatyoudownload.com"""
+    antitor_cache: TTLCache[str, tuple[int, dict[str, Any]]] = TTLCache(256, 3600)
+    antitor_quota = 1000
+    
+    async def _use_antitor_quota(self) -> None:
+        """Counts a request against the daily quota, the counter resets at midnight utc"""
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        quotas = self.bot.db.culturebot.quotas
+        await quotas.update_one({'_id': 'antitor', 'day': {'$ne': today}}, {'$set': {'day': today, 'used': 0}})
+        quota = await quotas.find_one_and_update(
+            {'_id': 'antitor'},
+            {'$inc': {'used': 1}, '$setOnInsert': {'day': today}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if quota['used'] > self.antitor_quota:
+            await quotas.update_one({'_id': 'antitor', 'day': today}, {'$inc': {'used': -1}})
+            raise commands.CommandError("The daily limit for this command has been reached, try again tomorrow.")
+    
+    async def _antitor_history(self, ip: str, amount: int) -> dict[str, Any]:
+        """Returns the torrent history of an ip, smaller amounts are served from larger cached results"""
+        cached = self.antitor_cache.get(ip)
+        # a result with less contents than requested is the whole history
+        if cached is not None and (cached[0] >= amount or len(cached[1]['contents']) < cached[0]):
+            data = cached[1]
+            return data | {'contents': data['contents'][:amount]}
+        
+        await self._use_antitor_quota()
         async with self.bot.session.get(
             'https://api.antitor.com/history/peer',
-            params=dict(ip=ip, contents=min(amount, 20), key=self.config['antitor_key'])
+            params=dict(ip=ip, contents=amount, key=self.config['antitor_key'])
         ) as r:
             data = await r.json()
         
+        if 'error' not in data:
+            self.antitor_cache[ip] = (amount, data)
+        return data
+    
+    @commands.command('antitor', aliases=['iknowwhatyoudownload', 'torrent', 'peer']) 
+    @commands.cooldown(rate=5, per=60, type=commands.BucketType.user)
+    async def antitor(self, ctx: commands.Context, ip: str, amount: int = 10):
+        """Shows the torrent history of an ip. Powered by iknowwhatyoudownload.com"""
+        data = await self._antitor_history(ip, min(amount, 20))
+        
         if 'error' in data:
             raise commands.CommandError(data['message'])
         if not data['contents']:
@@ -80,31 +114,69 @@ class Misc(CCog):
     
     async def init(self) -> None:
         with open('assets/swears.txt') as file:
-            self.swear_words = set(file.read().splitlines())
+            self.swear_matcher = WordMatcher(file.read().splitlines())
+        
+        await self.bot.wait_until_ready()
+        # swears are counted in memory and written in bulk
+        self.swear_buffer = IncrementBuffer(
+            self.bot.db.culturebot.swears, ('guild', 'member'), max_size=500, interval=60,
+            on_flush=lambda keys: self.bot.dispatch('swears_flush', {guild for guild, _ in keys})
+        )
+        self.swear_buffer.start()
+        
+        await self.bot.db.culturebot.swears.create_index([('guild', 1), ('total', -1)])
+    
+    async def close(self) -> None:
+        # the buffer is only created once the bot is ready
+        if hasattr(self, 'swear_buffer'):
+            await self.swear_buffer.close()
+    
+    async def swear_leaderboard(self, guild: int, limit: int = 10, swears: Optional[int] = 5) -> list[dict[str, Any]]:
+        """Returns the members of a guild who swore the most along with their most common swears
+        
+        The sorting and the extraction of top swears is done by mongo using the (guild, total) index.
+        If swears is None all swears of a member are returned.
+        """
+        pipeline: list[dict[str, Any]] = [
+            {'$match': {'guild': guild}},
+            {'$sort': {'total': -1}},
+            {'$limit': limit},
+            {'$project': {'member': 1, 'total': 1, 'swears': {'$objectToArray': '$swears'}}},
+            {'$unwind': '$swears'},
+            {'$sort': {'total': -1, 'member': 1, 'swears.v': -1}},
+            {'$group': {
+                '_id': '$member', 
+                'total': {'$first': '$total'}, 
+                'swears': {'$push': {'swear': '$swears.k', 'amount': '$swears.v'}}
+            }},
+            {'$sort': {'total': -1, '_id': 1}},
+            {'$project': {
+                '_id': 0, 
+                'member': '$_id', 
+                'total': 1, 
+                'swears': {'$slice': ['$swears', swears]} if swears is not None else 1
+            }},
+        ]
+        return [doc async for doc in self.bot.db.culturebot.swears.aggregate(pipeline)]
     
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        words = Counter(word for word in message.content.split() if word in self.swear_words)
+        words = self.swear_matcher.count(message.content)
         if not words or sum(words.values()) > 15 or message.guild is None:
             return
         
-        await self.bot.db.culturebot.swears.update_one(
-            {'member': message.author.id, 'guild': message.guild.id},
-            {'$inc': {f'swears.{k}': v for k,v in words.items()} | {'total': sum(words.values())}},
-            upsert=True
+        self.swear_buffer.inc(
+            (message.guild.id, message.author.id),
+            {f'swears.{k}': v for k,v in words.items()} | {'total': sum(words.values())}
         )
     
     @commands.command()
     @commands.guild_only()
     async def swears(self, ctx: GuildContext, user: Union[discord.User, discord.Member] = None):
         """Short help"""
+        await self.swear_buffer.flush()
         if user is None:
-            # there is a proper way to do this but I can't be fucked.
-            swears = [
-                (doc['member'], doc['swears']) async for doc in 
-                self.bot.db.culturebot.swears.find({'guild': ctx.guild.id})
-            ]
-            swears.sort(key=lambda x: sum(x[1].values()), reverse=True)
+            swears = await self.swear_leaderboard(ctx.guild.id)
             
             if len(swears) == 0:
                 await ctx.send("Nobody has ever sworn in this server")
@@ -115,16 +187,12 @@ class Misc(CCog):
                 title=f"Top 10 users who have sworn the most",
                 description=f"List of the top 10 users who have the most of swears in {ctx.guild.name}"
             )
-            for rank, (u, s) in enumerate(swears[:10], 1):
-                # handle deleted users and such
-                try:
-                    su = self.bot.get_user(u) or await self.bot.fetch_user(u)
-                except:
-                    su = "Unknown user"
+            names = await get_user_names(self.bot, [doc['member'] for doc in swears])
+            for rank, (doc, name) in enumerate(zip(swears, names), 1):
                 embed.add_field(
-                    name=f"{rank} - {su}",
-                    value=f"Sweared **{sum(s.values())}** time{'s'*(len(s)!=1)}.\nMost common swears: " + 
-                            '**' + ', '.join(sorted(s.keys(), key=lambda k: -s[k])[:5]) + '**', 
+                    name=f"{rank} - {name or 'Unknown user'}",
+                    value=f"Sweared **{doc['total']}** time{'s'*(doc['total']!=1)}.\nMost common swears: " + 
+                            '**' + ', '.join(i['swear'] for i in doc['swears']) + '**', 
                     inline=False
                 )
             await ctx.send(embed=embed)
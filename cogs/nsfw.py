@@ -1,15 +1,17 @@
 from __future__ import annotations
-import io
+import asyncio
 import json
 import random
 import re
 import textwrap
-from typing import List, Optional, Sequence
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, List, Optional, Sequence, Set, Tuple
 
 import aiohttp
 import discord
+from cachetools import TTLCache
 from discord.ext import commands
-from utils import CCog, send_pages
+from utils import CCog, PrefetchBuffer, send_pages
 
 
 class SearchError(Exception):
@@ -26,48 +28,129 @@ class NSFW(CCog):
         self.danbooru_auth = aiohttp.BasicAuth(
             self.config['login'], self.config['api_key']
         )
+        # random results are prefetched so commands don't wait on the upstream apis
+        self.neko_buffers: Dict[str, PrefetchBuffer[str]] = {}
+        self.yiff_buffers: Dict[str, PrefetchBuffer[str]] = {}
+        self.hanime_buffer: PrefetchBuffer[list] = PrefetchBuffer(self._fetch_hanime_random, 2)
+        self.presence_cache: TTLCache[str, List[str]] = TTLCache(1, 30 * 60)
     
     async def init(self):
         await self.bot.wait_until_ready()
         await self._set_yiff_categories()
+        self.hanime_buffer.fill()
+        self._neko_buffer('neko').fill()
 
-    def cog_unload(self):
+    async def close(self) -> None:
+        for buffer in [self.hanime_buffer, *self.neko_buffers.values(), *self.yiff_buffers.values()]:
+            buffer.cancel()
         if not self.session.closed:
-            self.bot.loop.create_task(self.session.close())
+            await self.session.close()
 
-    async def search_danbooru(self, tags: Sequence[str], limit: int = 200, rating: Optional[str] = None) -> List[dict]:
-        """Searches danbooru for posts.
-        
-        Works by using tags for both searching and then filtering.
-        This bypasses the need for a premium account.
-        """
-        # first we separate the main tags from the secondary filter tags
-        # the rating tag should be removed from filter tags since it's not really a tag
-        main_tags, filter_tags = tags[:2], tags[2:]
-        rating_tag = next((i for i in filter_tags if i.startswith('rating:')), None)
-        if rating_tag is not None:
-            rating = rating_tag.split(':')[1][0]
+    # raw pages are cached since filter tags and the rating are applied locally anyway
+    danbooru_cache: TTLCache[tuple[tuple[str, ...], int, int], List[dict]] = TTLCache(256, 300)
+    
+    async def _danbooru_page(self, main_tags: Sequence[str], page: int = 1, limit: int = 200, cache: bool = True) -> List[dict]:
+        """Fetches a single page of raw posts for the main tags, pages are cached for 5 minutes"""
+        key = (tuple(tag.lower() for tag in main_tags), page, limit)
+        if key in self.danbooru_cache:
+            return self.danbooru_cache[key]
         
-        # then we join the tags into a query param and construct a url
+        # we join the tags into a query param and construct a url
         # we don't use params because that encodes the needed separators
         url = self.url + '?tags='+'+'.join(main_tags)
-        params = {'limit': limit}
+        params = {'limit': limit, 'page': page}
         # we use authentication so there aren't any ratelimits
         async with self.session.get(url, params=params, auth=self.danbooru_auth) as r:
             posts = await r.json()
             if r.status != 200:
                 raise commands.BadArgument(posts['message'])
         
-        # finally filter the posts by checking if all filter tags are present
-        posts = [
-            post for post in posts 
-            if post['parent_id'] is None and post.get('file_url') and
-            all(tag[1:] not in post['tag_string'] if tag.startswith('-') else tag in post['tag_string'] 
-                for tag in filter_tags) and
-            (rating is None or post['rating'] == rating)
-        ]
+        if cache:
+            self.danbooru_cache[key] = posts
         return posts
+    
+    @staticmethod
+    def _parse_tags(tags: Sequence[str], rating: Optional[str] = None) -> Tuple[Sequence[str], Set[str], Set[str], Optional[str]]:
+        """Splits tags into main tags, included and excluded filter tags and a rating"""
+        # the rating tag should be removed from filter tags since it's not really a tag
+        main_tags, filter_tags = tags[:2], tags[2:]
+        rating_tag = next((i for i in filter_tags if i.startswith('rating:')), None)
+        if rating_tag is not None:
+            rating = rating_tag.split(':')[1][0]
+        include = {tag for tag in filter_tags if not tag.startswith(('-', 'rating:'))}
+        exclude = {tag[1:] for tag in filter_tags if tag.startswith('-')}
+        return main_tags, include, exclude, rating
+    
+    @staticmethod
+    def _filter_posts(posts: List[dict], include: Set[str], exclude: Set[str], rating: Optional[str]) -> List[dict]:
+        """Filters posts by checking whether all filter tags are present"""
+        # tags are compared as whole tags so "cat" doesn't match "cat_ears"
+        results = []
+        for post in posts:
+            if post['parent_id'] is not None or not post.get('file_url'):
+                continue
+            if rating is not None and post['rating'] != rating:
+                continue
+            post_tags = set(post['tag_string'].split())
+            if include <= post_tags and post_tags.isdisjoint(exclude):
+                results.append(post)
+        return results
+    
+    async def search_danbooru(
+        self, 
+        tags: Sequence[str], 
+        limit: int = 200, 
+        rating: Optional[str] = None,
+        min_results: int = 20,
+        max_pages: int = 5
+    ) -> List[dict]:
+        """Searches danbooru for posts.
+        
+        Works by using tags for both searching and then filtering.
+        This bypasses the need for a premium account.
+        When filtering leaves less than min_results posts, up to max_pages pages are fetched concurrently.
+        """
+        # first we separate the main tags from the secondary filter tags
+        main_tags, include, exclude, rating = self._parse_tags(tags, rating)
         
+        first = await self._danbooru_page(main_tags, 1, limit)
+        posts = self._filter_posts(first, include, exclude, rating)
+        # a full first page means there may be more results worth filtering
+        if len(posts) < min_results and len(first) == limit and max_pages > 1:
+            pages = await asyncio.gather(*(self._danbooru_page(main_tags, page, limit) for page in range(2, max_pages + 1)))
+            # pages shift when new posts are uploaded so the same post may appear twice
+            seen = {post['id'] for post in posts}
+            for page in pages:
+                for post in self._filter_posts(page, include, exclude, rating):
+                    if post['id'] not in seen:
+                        seen.add(post['id'])
+                        posts.append(post)
+        
+        return posts
+    
+    async def export_danbooru(self, tags: Sequence[str], file: IO[bytes], max_pages: int = 50, concurrency: int = 4) -> int:
+        """Writes the urls of every post found for tags into a file, returns the amount of urls written
+        
+        Pages are requested concurrently in batches and written in order as soon as each batch arrives.
+        """
+        main_tags, include, exclude, rating = self._parse_tags(tags)
+        limit = 200
+        seen: Set[int] = set()
+        for start in range(1, max_pages + 1, concurrency):
+            # exported pages are not cached, they would push out pages of actual searches
+            pages = await asyncio.gather(*(
+                self._danbooru_page(main_tags, page, limit, cache=False)
+                for page in range(start, min(start + concurrency, max_pages + 1))
+            ))
+            for posts in pages:
+                for post in self._filter_posts(posts, include, exclude, rating):
+                    if post['id'] not in seen:
+                        seen.add(post['id'])
+                        file.write(post['file_url'].encode() + b'\n')
+                if len(posts) < limit:
+                    return len(seen)
+        
+        return len(seen)
     
     @commands.group('booru', aliases=['danbooru'], invoke_without_command=True)
     @commands.is_nsfw()
@@ -88,7 +171,7 @@ class NSFW(CCog):
                 f"the combination of tags does not have any posts.")
             return
         
-        embeds = [
+        embeds = (
             discord.Embed(
                 description=f"result for search: `{' '.join(tags)}`", 
                 color=discord.Colour.red()
@@ -108,7 +191,7 @@ class NSFW(CCog):
                 text=f"id: {post['id']} | character: {post['tag_string_character']} | artist: {post['tag_string_artist']}"
             )
             for post in posts
-        ]
+        )
         
         await send_pages(ctx, ctx, embeds)
     
@@ -132,22 +215,45 @@ class NSFW(CCog):
     @booru.command('export', aliases=['txt', 'file'])
     @commands.is_nsfw()
     async def booru_export(self, ctx: commands.Context, *tags):
-        """Like booru except sends all found images as a list of links in a txt file"""
-        posts = await self.search_danbooru(tags)
-        images = '\n'.join(post['file_url'] for post in posts)
-        file = discord.File(io.BytesIO(images.encode()), f"booru_{'-'.join(tags)}.txt")
-        await ctx.send(file=file)
+        """Like booru except sends all found images as a list of links in a txt file
+        
+        Goes through many pages of results so it may take a while.
+        """
+        await ctx.trigger_typing()
+        with SpooledTemporaryFile(0x100000) as file:
+            amount = await self.export_danbooru(tags, file, self.config.getint('export_pages', 50))
+            if amount == 0:
+                await ctx.send(f"No posts were returned for `{' '.join(tags)}`")
+                return
+            
+            file.seek(0)
+            await ctx.send(f"Exported {amount} posts", file=discord.File(file, f"booru_{'-'.join(tags)}.txt"))
+    
+    async def _fetch_neko(self, category: str) -> List[str]:
+        async with self.session.get(f"https://nekos.life/api/v2/img/{category}") as r:
+            data = await r.json()
+        if data.get('msg') == '404':
+            raise SearchError(f'Tag `{category}` does not exist')
+        return [data['url']]
+    
+    def _neko_buffer(self, category: str) -> PrefetchBuffer[str]:
+        if category not in self.neko_buffers:
+            self.neko_buffers[category] = PrefetchBuffer(lambda: self._fetch_neko(category), 3)
+        return self.neko_buffers[category]
     
     @commands.command('neko')
     async def neko(self, ctx: commands.Context, category: str = 'neko'):
         """Sends a random image from nekos.life"""
         category = category.lower()
-        async with self.session.get(f"https://nekos.life/api/v2/img/{category}") as r:
-            data = await r.json()
-            if data.get('msg') == '404':
-                await ctx.send(f'Tag `{category}` does not exist')
-                return
-            image: str = data['url']
+        try:
+            image = await self._neko_buffer(category).get()
+        except SearchError as e:
+            # only existing categories keep a buffer
+            buffer = self.neko_buffers.pop(category, None)
+            if buffer is not None:
+                buffer.cancel()
+            await ctx.send(str(e))
+            return
         
         await ctx.send(image)
     
@@ -178,6 +284,17 @@ class NSFW(CCog):
             data = json.loads(data['hits']) # wtf hanime
             return data
     
+    async def _fetch_hanime_random(self) -> List[list]:
+        return [await self.hanime_random()]
+    
+    async def random_hentai_name(self) -> str:
+        """Returns the name of a popular random hentai, picked from a list refreshed every 30 minutes"""
+        names = self.presence_cache.get('names')
+        if names is None:
+            hentai = await self.hanime_buffer.get()
+            names = self.presence_cache['names'] = [i['name'] for i in hentai[:5]]
+        return random.choice(names)
+    
     async def hanime_random(self) -> list:
         async with self.session.get(
             "https://members.hanime.tv/rapi/v7/hentai_videos",
@@ -197,7 +314,7 @@ class NSFW(CCog):
         if len(data) == 0:
             await ctx.send(f"No hentai found for query `{query}`")
             return
-        embeds = [
+        embeds = (
             discord.Embed(
                 colour=discord.Colour.gold(),
                 title=hentai['name'],
@@ -215,14 +332,14 @@ class NSFW(CCog):
                     f"{hentai['likes']} likes & {hentai['dislikes']} dislikes"
             )
             for hentai in data
-        ]
+        )
         await send_pages(ctx, ctx, embeds)
     
     @hanime.command('random')
     @commands.is_nsfw()
     async def hanimerandom(self, ctx: commands.Context):
-        data = await self.hanime_random()
-        embeds = [
+        data = await self.hanime_buffer.get()
+        embeds = (
             discord.Embed(
                 colour=discord.Colour.gold(),
                 description=f"{hentai['views']} views\n"
@@ -236,7 +353,7 @@ class NSFW(CCog):
                 text=f"page: {i}/{len(data)}"
             )
             for i,hentai in enumerate(data, 1)
-        ]
+        )
         await send_pages(ctx, ctx, embeds)
     
     async def _set_yiff_categories(self) -> None:
@@ -246,6 +363,11 @@ class NSFW(CCog):
         
         self._yiff_categories: List[List[str]] = [i['db'].split('.') for i in categories if 'animals' not in i['db']]
     
+    async def _fetch_yiff(self, category: str) -> List[str]:
+        async with self.session.get(f"https://v2.yiff.rest/{category}", params={'limit': 5}) as r:
+            images = (await r.json())['images']
+        return [image['url'] for image in images]
+    
     @commands.command('yiff', aliases=['furry'])
     @commands.is_nsfw()
     async def yiff(self, ctx: commands.Context, category = 'Straight'):
@@ -261,10 +383,11 @@ class NSFW(CCog):
             return
 
         category = '/'.join(category)
-        async with self.session.get(f"https://v2.yiff.rest/{category}") as r:
-            image: dict = (await r.json())['images'][0]
+        if category not in self.yiff_buffers:
+            self.yiff_buffers[category] = PrefetchBuffer(lambda: self._fetch_yiff(category), 5)
+        image = await self.yiff_buffers[category].get()
         
-        await ctx.send(image['url'])
+        await ctx.send(image)
         
                 
     
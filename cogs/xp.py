@@ -1,44 +1,72 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+import itertools
 import random
+from typing import Any, Optional
 from utils.types import GuildContext
 
 import discord
-from discord.ext import commands, tasks
-from utils import CCog
+from cachetools import TTLCache
+from discord.ext import commands
+from utils import CCog, ExpiringRatelimit, IncrementBuffer, get_user_names, send_pages
 
 
 class XP(CCog):
     """Short description"""
-    last_messages: dict[discord.Member, datetime] = {}
-    ratelimit = timedelta(minutes=2)
+    last_messages = ExpiringRatelimit(2 * 60)
+    
+    settings_cache: TTLCache[int, Optional[dict[str, Any]]] = TTLCache(1024, 600)
     
     async def init(self):
         await self.bot.wait_until_ready()
         self.db = self.bot.db.xp
-        self.last_messages_cleanup.start()
+        # xp is accumulated in memory and written in bulk
+        self.xp_buffer = IncrementBuffer(
+            self.db.xp, ('guild', 'member'), max_size=500, interval=60,
+            on_flush=lambda keys: self.bot.dispatch('xp_flush', {guild for guild, _ in keys})
+        )
+        self.xp_buffer.start()
+        
+        await self.db.xp.create_index([('guild', 1), ('xp', -1), ('member', 1)])
+    
+    async def close(self) -> None:
+        # the buffer is only created once the bot is ready
+        if hasattr(self, 'xp_buffer'):
+            await self.xp_buffer.close()
+    
+    async def get_settings(self, guild: int) -> Optional[dict[str, Any]]:
+        """Returns the xp settings of a guild, cached until they're updated"""
+        if guild not in self.settings_cache:
+            self.settings_cache[guild] = await self.db.settings.find_one(
+                {'id': guild, 'msgxp': {'$exists': True}}
+            )
+        return self.settings_cache[guild]
+    
+    async def update_settings(self, guild: int, **settings: Any) -> None:
+        """Updates the xp settings of a guild and invalidates the cache"""
+        await self.db.settings.update_one({'id': guild}, {'$set': settings}, upsert=True)
+        self.settings_cache.pop(guild, None)
+    
+    async def leaderboard_page(self, guild: int, limit: int = 10, skip: int = 0) -> list[dict[str, Any]]:
+        """Returns a page of the xp leaderboard of a guild, ties are ordered by member so pages are stable"""
+        cursor = self.db.xp.find({'guild': guild}).sort([('xp', -1), ('member', 1)]).skip(skip).limit(limit)
+        return [data async for data in cursor]
+    
+    async def get_rank(self, guild: int, member: int) -> Optional[tuple[int, int]]:
+        """Returns the xp and the leaderboard rank of a member, the rank is an indexed count"""
+        data = await self.db.xp.find_one({'guild': guild, 'member': member})
+        if data is None:
+            return None
         
-    @tasks.loop(minutes=10)
-    async def last_messages_cleanup(self):
-        now = datetime.now()
-        members = list(self.last_messages.keys()) # create copy
-        for m in members:
-            if now - self.last_messages[m] > self.ratelimit:
-                del self.last_messages[m]
+        above = await self.db.xp.count_documents({'guild': guild, 'xp': {'$gt': data['xp']}})
+        return data['xp'], above + 1
     
     async def give_xp(self, member: discord.Member):
         await self.bot.wait_until_ready()
-        settings = await self.db.settings.find_one(
-            {'id': member.guild.id, 'amount': {'$exists': True}}
-        )
+        settings = await self.get_settings(member.guild.id)
         amount = settings['msgxp'] if settings else random.randint(10, 20)
         
-        await self.db.xp.update_one(
-            {'guild': member.guild.id, 'member': member.id},
-            {'$inc': {'xp': amount}},
-            upsert=True
-        )
+        self.xp_buffer.inc((member.guild.id, member.id), {'xp': amount})
     
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -49,9 +77,8 @@ class XP(CCog):
         if len(message.content) <= 10 or not all(i==' ' or i.isalpha() for i in message.content[:5]):
             return
         
-        last = self.last_messages.get(message.author)
-        if last is None or datetime.now() - last > self.ratelimit:
-            self.last_messages[message.author] = datetime.now()
+        # guild and member ids are snowflakes which fit into 64 bits
+        if self.last_messages.hit(message.guild.id << 64 | message.author.id):
             await self.give_xp(message.author)
     
     @commands.group(invoke_without_command=True)
@@ -59,40 +86,69 @@ class XP(CCog):
     async def xp(self, ctx: GuildContext, member: discord.Member = None):
         """Show a member's current xp"""
         member = member or ctx.author
-        data = await self.db.xp.find_one(
-            {'guild': ctx.guild.id, 'member': member.id}
-        )
-        if data is None:
+        await self.xp_buffer.flush()
+        rank = await self.get_rank(ctx.guild.id, member.id)
+        if rank is None:
             await ctx.send(f"{member} has never spoken in this server")
             return
 
-        xp = data['xp']
-        await ctx.send(f"You have {xp} xp")
+        xp, position = rank
+        await ctx.send(f"{member} has {xp} xp (rank #{position})")
+    
+    @xp.command('rank')
+    @commands.guild_only()
+    async def rank(self, ctx: GuildContext, member: discord.Member = None):
+        """Show a member's rank on the xp leaderboard"""
+        member = member or ctx.author
+        await self.xp_buffer.flush()
+        rank = await self.get_rank(ctx.guild.id, member.id)
+        if rank is None:
+            await ctx.send(f"{member} has never spoken in this server")
+            return
+        
+        xp, position = rank
+        await ctx.send(f"{member} is **#{position}** in {ctx.guild} with {xp}xp")
     
     @xp.command(aliases=['lb'])
     @commands.guild_only()
     async def leaderboard(self, ctx: GuildContext):
-        """Show a leaderboard of the top most active members"""
-        cursor = self.db.xp.find({'guild': ctx.guild.id}).sort('xp', -1).limit(10)
-        embed = discord.Embed(
-            colour=discord.Colour.blurple(),
-            title="XP Leaderboard",
-            description=f"Leaderboard of the most active users in {ctx.guild}"
-        )
-        i = 1
-        async for data in cursor:
-            user = self.bot.get_user(data['member']) or self.bot.fetch_user(data['member'])
-            embed.add_field(
-                name=f"{i}. {user}",
-                value=f"{data['xp']}xp",
-                inline=False
-            )
-            i += 1
-        
-        await ctx.send(embed=embed)
+        """Show a leaderboard of the most active members"""
+        await self.xp_buffer.flush()
+        if not await self.db.xp.count_documents({'guild': ctx.guild.id}, limit=1):
+            await ctx.send("Nobody has any xp in this server")
+            return
         
+        async def pages():
+            for skip in itertools.count(0, 10):
+                members = await self.leaderboard_page(ctx.guild.id, 10, skip)
+                if not members:
+                    return
+                
+                embed = discord.Embed(
+                    colour=discord.Colour.blurple(),
+                    title="XP Leaderboard",
+                    description=f"Leaderboard of the most active users in {ctx.guild}"
+                )
+                names = await get_user_names(self.bot, [data['member'] for data in members])
+                for i, (data, name) in enumerate(zip(members, names), skip + 1):
+                    embed.add_field(
+                        name=f"{i}. {name or 'Unknown user'}",
+                        value=f"{data['xp']}xp",
+                        inline=False
+                    )
+                yield embed
         
+        await send_pages(ctx, ctx, pages())
     
+    @xp.command('amount', aliases=['msgxp'])
+    @commands.has_permissions(manage_guild=True)
+    @commands.guild_only()
+    async def amount(self, ctx: GuildContext, amount: int):
+        """Sets how much xp members get per message, by default it's random between 10 and 20"""
+        await self.update_settings(ctx.guild.id, msgxp=amount)
+        await ctx.send(f"Members will now get {amount}xp per message")
+    
+
 
 def setup(bot):
     bot.add_cog(XP(bot))
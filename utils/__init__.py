@@ -2,6 +2,10 @@ from .ccog import *
 from .config import *
 from .discord import *
 from .formatting import *
+from .hoyolab import *
 from .interaction import *
+from .matching import *
+from .mongo import *
+from .ratelimit import *
 from .tools import *
 from .utils import *
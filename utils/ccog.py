@@ -20,6 +20,7 @@ class CCog(commands.Cog):
     bot: CBot
     config: configparser.SectionProxy
     logger: Logger = logger
+    _closed: bool = False
     
     def __init__(self, bot: CBot) -> None:
         pass
@@ -27,6 +28,19 @@ class CCog(commands.Cog):
     async def init(self) -> None:
         """Runs after __init__ as a task"""
     
+    async def close(self) -> None:
+        """Runs when the cog is unloaded or the bot is closing"""
+    
+    async def shutdown(self) -> None:
+        """Runs close() once, errors are logged instead of raised"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.close()
+        except Exception:
+            self.logger.exception(f"Could not close {self.__cog_name__}")
+    
     def __new__(cls, *args, **kwargs):
         cls.bot = args[0]
         
@@ -46,4 +60,5 @@ class CCog(commands.Cog):
     def cog_unload(self) -> None:
         for loop in self.__dict__.values():
             if isinstance(loop, tasks.Loop):
-                loop.cancel()
\ No newline at end of file
+                loop.cancel()
+        self.bot.loop.create_task(self.shutdown())
\ No newline at end of file
@@ -3,9 +3,10 @@ from __future__ import annotations
 import asyncio
 import re
 import warnings
-from typing import TYPE_CHECKING, AsyncIterable, Iterable, Union
+from typing import TYPE_CHECKING, AsyncIterable, Iterable, Optional, Union
 
 import discord
+from cachetools import TTLCache
 from discord.ext import commands
 
 from .tools import Paginator
@@ -59,6 +60,39 @@ async def get_webhook(channel: discord.TextChannel) -> discord.Webhook:
 
     return webhook
 
+_user_names: TTLCache[int, Optional[str]] = TTLCache(4096, 3600)
+async def get_user_names(bot: commands.Bot, ids: Iterable[int], concurrency: int = 10) -> list[Optional[str]]:
+    """Returns the names of multiple users in order, None for deleted users
+
+    Users which are neither in the bot's cache nor in the name cache are fetched concurrently.
+    """
+    ids = list(ids)
+    names: dict[int, Optional[str]] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def fetch(id: int) -> None:
+        async with semaphore:
+            try:
+                user = await bot.fetch_user(id)
+            except discord.NotFound:
+                user = None
+            except discord.HTTPException:
+                return # don't cache temporary errors
+        names[id] = _user_names[id] = str(user) if user else None
+
+    missing = set()
+    for id in ids:
+        user = bot.get_user(id)
+        if user is not None:
+            names[id] = str(user)
+        elif id in _user_names:
+            names[id] = _user_names[id]
+        else:
+            missing.add(id)
+    
+    await asyncio.gather(*(fetch(id) for id in missing))
+    return [names.get(id) for id in ids]
+
 def get_emoji(name: str, guild: discord.Guild = None) -> discord.Emoji:
     """Returns the emoji from the main server"""
     if guild is None:
@@ -72,6 +106,22 @@ def get_emoji(name: str, guild: discord.Guild = None) -> discord.Emoji:
     
     return emoji
 
+def add_reactions(message: discord.Message, reactions: Iterable[Union[str, discord.Emoji]]) -> asyncio.Task[None]:
+    """Adds reactions to a message in the background and returns the task
+
+    Reactions share a single ratelimit bucket so they're pipelined one after another
+    instead of being fired all at once, this keeps their order and avoids 429s.
+    The caller can start listening right away and cancel the task once it's done.
+    """
+    async def adder():
+        for reaction in reactions:
+            try:
+                await message.add_reaction(reaction)
+            except discord.NotFound:
+                return # message was deleted in the meantime
+    
+    return asyncio.create_task(adder())
+
 async def _try_delete_reaction(message: discord.Message, payload: discord.RawReactionActionEvent) -> None:
     try:
         await message.remove_reaction(payload.emoji, discord.Object(id=payload.user_id))
@@ -96,8 +146,7 @@ async def send_pages(
     else:
         message = await destination.send(embed=paginator.curr)
 
-    for reaction in (page_left, page_right, remove):
-        asyncio.create_task(message.add_reaction(reaction))
+    adder = add_reactions(message, (page_left, page_right, remove))
 
     while True:
         try:
@@ -107,6 +156,7 @@ async def send_pages(
                 timeout=timeout,
             )
         except asyncio.TimeoutError:
+            adder.cancel()
             try:
                 await message.clear_reactions()
             except discord.Forbidden:
@@ -121,6 +171,7 @@ async def send_pages(
         r = str(payload.emoji)
         if r == remove:
             del_task.cancel()
+            adder.cancel()
             await message.delete()
             return
         elif r == page_right:
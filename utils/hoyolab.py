@@ -0,0 +1,183 @@
+"""Asynchronous client for the hoyolab apis used by the bot"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Mapping, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+import genshinstats as gs
+from genshinstats.genshinstats import CN_DS_SALT, CN_TAKUMI_URL, OS_BBS_URL, OS_DS_SALT, generate_ds_token
+from genshinstats.wishes import GACHA_INFO_URL
+
+
+class HoyolabClient:
+    """Like genshinstats except asynchronous and running on a shared aiohttp session.
+
+    Every method returns the same shapes as its genshinstats counterpart and raises the same errors,
+    responses are prettified with genshinstats' own functions.
+    Requests reuse the connections of the given session but never store cookies.
+    """
+    session: aiohttp.ClientSession
+    tries: int = 3
+    _banner_types: dict[str, dict[int, str]]
+
+    def __init__(self, session: aiohttp.ClientSession) -> None:
+        # set-cookie from hoyolab would otherwise end up in a jar that overrides the cookie header
+        self.session = aiohttp.ClientSession(
+            connector=session.connector, connector_owner=False, cookie_jar=aiohttp.DummyCookieJar()
+        )
+        self._banner_types = {}
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}>"
+
+    async def close(self) -> None:
+        """Closes the client's session, the shared connections are left open"""
+        await self.session.close()
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> Any:
+        # sometimes a random connection error can just occur, mihoyo being mihoyo
+        for attempt in range(self.tries):
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    r.raise_for_status()
+                    data = await r.json(content_type=None)
+                break
+            except aiohttp.ClientConnectionError:
+                if attempt == self.tries - 1:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+        if data['retcode'] == 0:
+            return data['data']
+        gs.errors.raise_for_error(data)
+
+    async def fetch_endpoint(
+        self,
+        endpoint: str,
+        chinese: bool = False,
+        cookie: Optional[Mapping[str, Any]] = None,
+        method: str = 'GET',
+        lang: str = 'en-us',
+        **kwargs: Any,
+    ) -> Any:
+        """Fetches an endpoint of the game record api, authenticated with a cookie"""
+        headers = {
+            'user-agent': gs.utils.USER_AGENT,
+            'x-rpc-language': lang,
+        }
+        if chinese:
+            headers.update({'ds': generate_ds_token(CN_DS_SALT), 'x-rpc-app_version': "2.7.0", 'x-rpc-client_type': "5"})
+            url = urljoin(CN_TAKUMI_URL, endpoint)
+        else:
+            headers.update({'ds': generate_ds_token(OS_DS_SALT), 'x-rpc-app_version': "1.5.0", 'x-rpc-client_type': "4"})
+            url = urljoin(OS_BBS_URL, endpoint)
+
+        if cookie is None:
+            raise gs.NotLoggedIn('Login cookies have not been provided')
+        if cookie:
+            headers['cookie'] = '; '.join(f"{k}={v}" for k, v in cookie.items())
+
+        return await self._request(method, url, headers=headers, **kwargs)
+
+    async def fetch_gacha_endpoint(self, endpoint: str, authkey: str, **params: Any) -> Any:
+        """Fetches an endpoint of the gacha log api, authenticated with an authkey"""
+        params = {'authkey_ver': "1", 'lang': "en", 'sign_type': "2", 'authkey': authkey, **params}
+        return await self._request(
+            'GET', urljoin(GACHA_INFO_URL, endpoint),
+            headers={'user-agent': gs.utils.USER_AGENT}, params=params
+        )
+
+    async def get_user_stats(self, uid: int, cookie: Optional[Mapping[str, Any]] = None) -> dict[str, Any]:
+        """Gets basic user information and stats."""
+        data = await self.fetch_endpoint(
+            "game_record/genshin/api/index",
+            chinese=gs.is_chinese(uid),
+            cookie=cookie,
+            params=dict(server=gs.recognize_server(uid), role_id=uid)
+        )
+        return gs.pretty.prettify_stats(data)
+
+    async def get_characters(
+        self, uid: int, character_ids: Optional[list[int]] = None, lang: str = 'en-us', cookie: Optional[Mapping[str, Any]] = None
+    ) -> list[dict[str, Any]]:
+        """Gets characters of a user, only the ones with character_ids if provided."""
+        if character_ids is None:
+            character_ids = [i['id'] for i in (await self.get_user_stats(uid, cookie))['characters']]
+
+        data = await self.fetch_endpoint(
+            "game_record/genshin/api/character",
+            chinese=gs.is_chinese(uid),
+            cookie=cookie,
+            method='POST',
+            lang=lang,
+            json=dict(character_ids=character_ids, role_id=uid, server=gs.recognize_server(uid))
+        )
+        return gs.pretty.prettify_characters(data['avatars'])
+
+    async def get_spiral_abyss(self, uid: int, previous: bool = False, cookie: Optional[Mapping[str, Any]] = None) -> dict[str, Any]:
+        """Gets spiral abyss runs of a user, previous gets the last season."""
+        data = await self.fetch_endpoint(
+            "game_record/genshin/api/spiralAbyss",
+            chinese=gs.is_chinese(uid),
+            cookie=cookie,
+            params=dict(server=gs.recognize_server(uid), role_id=uid, schedule_type=2 if previous else 1)
+        )
+        return gs.pretty.prettify_abyss(data)
+
+    async def get_record_card(self, hoyolab_uid: int, chinese: bool = False, cookie: Optional[Mapping[str, Any]] = None) -> Optional[dict[str, Any]]:
+        """Gets a game record card of a user based on their hoyolab uid."""
+        data = await self.fetch_endpoint(
+            "game_record/card/wapi/getGameRecordCard",
+            chinese=chinese,
+            cookie=cookie,
+            params=dict(uid=hoyolab_uid, gids=2)
+        )
+        return data['list'][0] if data['list'] else None
+
+    async def get_recommended_users(self, page_size: Optional[int] = None) -> list[dict[str, Any]]:
+        """Gets a list of recommended active users"""
+        data = await self.fetch_endpoint(
+            "community/user/wapi/recommendActive",
+            cookie={},
+            params=dict(page_size=page_size or 0x10000, offset=0, gids=2)
+        )
+        return data['list']
+
+    async def get_langs(self) -> dict[str, str]:
+        """Gets codes of all languages and their names"""
+        data = await self.fetch_endpoint("community/misc/wapi/langs", cookie={}, params=dict(gids=2))
+        return {i['value']: i['name'] for i in data['langs']}
+
+    async def get_banner_types(self, authkey: str, lang: str = 'en') -> dict[int, str]:
+        """Gets ids for all banners and their names, cached per language"""
+        if lang not in self._banner_types:
+            data = await self.fetch_gacha_endpoint("getConfigList", authkey, lang=lang)
+            self._banner_types[lang] = {int(i['key']): i['name'] for i in data['gacha_type_list']}
+        return self._banner_types[lang]
+
+    async def get_wish_history(self, banner_type: int, authkey: str, end_id: int = 0, lang: str = 'en') -> AsyncIterator[dict[str, Any]]:
+        """Yields the wish history of a banner newest first, requesting pages only as they're consumed"""
+        banner_name = (await self.get_banner_types(authkey, lang))[banner_type]
+        page_size = 20
+        while True:
+            data = await self.fetch_gacha_endpoint(
+                "getGachaLog", authkey,
+                gacha_type=banner_type, size=page_size, end_id=end_id, lang=lang
+            )
+            pulls = gs.pretty.prettify_wish_history(data['list'], banner_name)
+            for pull in pulls:
+                yield pull
+
+            if len(pulls) < page_size:
+                return
+            end_id = pulls[-1]['id']
+
+    async def get_uid_from_authkey(self, authkey: str) -> int:
+        """Gets a uid from an authkey."""
+        # sorted from most to least pulled on for speed
+        for banner_type in (301, 200, 302, 100):
+            async for pull in self.get_wish_history(banner_type, authkey):
+                return pull['uid']
+        raise gs.GenshinStatsException('User has never made a wish')
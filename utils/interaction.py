@@ -9,6 +9,7 @@ import discord
 from discord.ext import commands
 
 from .config import config
+from .discord import add_reactions
 from .formatting import chunkify
 from .tools import zip_once
 
@@ -40,14 +41,15 @@ async def report_bug(ctx: commands.Context, error: Exception, description: str =
 async def confirm(bot: commands.Bot, message: discord.Message, user: discord.abc.User, timeout: int = 15) -> bool:
     """Confirms a message"""
     yes, no = "✅", "❌"
-    await message.add_reaction(yes)
-    await message.add_reaction(no)
+    adder = add_reactions(message, (yes, no))
     try:
         reaction, _ = await bot.wait_for(
             "reaction_add", check=lambda r, u: str(r) in (yes, no) and u == user, timeout=timeout
         )
     except asyncio.TimeoutError:
         return False
+    finally:
+        adder.cancel()
 
     if str(reaction) == yes:
         await message.remove_reaction(no, bot.user)
@@ -80,10 +82,7 @@ async def discord_choice(
         # possible enums should be accounted for
         reactions = {getattr(i, "value", str(i)).strip(): i for i in choices}
 
-    for i in reactions:
-        await message.add_reaction(i)
-    if cancel:
-        await message.add_reaction(cancel)
+    adder = add_reactions(message, [*reactions, cancel] if cancel else reactions)
 
     try:
         reaction, _ = await bot.wait_for(
@@ -96,6 +95,7 @@ async def discord_choice(
             await message.delete()
         return None
     finally:
+        adder.cancel()
         try:
             await message.clear_reactions()
         except discord.NotFound:
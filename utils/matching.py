@@ -0,0 +1,110 @@
+"""Fast multi-pattern text matching"""
+from __future__ import annotations
+
+import string
+from collections import Counter, deque
+from typing import Iterable, Optional
+
+LEETSPEAK = {'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '@': 'a', '$': 's'}
+
+
+class WordMatcher:
+    """An Aho-Corasick automaton that counts whole words and phrases in a single pass.
+
+    Both the words and the searched text are normalized the same way,
+    normalization can be configured with casefold, punctuation and leetspeak.
+    Phrases match across any amount of whitespace between their words.
+    Leetspeak is only undone in tokens with a letter so plain numbers stay numbers.
+    """
+    casefold: bool
+    _table: dict[int, Optional[str]]
+    _leetspeak: dict[int, str]
+    _goto: list[dict[str, int]]
+    _fail: list[int]
+    _output: list[tuple[str, ...]]
+
+    def __init__(self, words: Iterable[str], casefold: bool = True, punctuation: bool = True, leetspeak: bool = True) -> None:
+        self.casefold = casefold
+        self._table = {}
+        self._leetspeak = {ord(k): v for k, v in LEETSPEAK.items()} if leetspeak else {}
+        if punctuation:
+            # punctuation separates words except for apostrophes which are a part of them
+            self._table.update({ord(c): ' ' for c in string.punctuation if ord(c) not in self._leetspeak})
+            self._table[ord("'")] = None
+
+        self._goto, self._fail, self._output = [{}], [0], [()]
+        patterns: dict[str, str] = {}
+        for word in words:
+            key = self.normalize(word)
+            if key and key not in patterns:
+                patterns[key] = word
+
+        for key, word in patterns.items():
+            # padding with spaces makes the automaton match only whole words
+            self._add(f" {key} ", word)
+        self._build()
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} states={len(self._goto)}>"
+
+    def normalize(self, text: str) -> str:
+        """Normalizes text the same way the words were normalized"""
+        if self.casefold:
+            text = text.casefold()
+        tokens = text.translate(self._table).split()
+        if self._leetspeak:
+            tokens = [token.translate(self._leetspeak) if any(c.isalpha() for c in token) else token for token in tokens]
+        return ' '.join(tokens)
+
+    def _add(self, pattern: str, word: str) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state] = (word,)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def count(self, text: str) -> Counter[str]:
+        """Counts the occurrences of every word in a text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        counts: Counter[str] = Counter()
+        state = 0
+        for char in f" {self.normalize(text)} ":
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                counts[word] += 1
+        return counts
+
+
+if __name__ == '__main__':
+    # micro-benchmark against the old exact-token set lookup
+    import random
+    import timeit
+
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 8))) for _ in range(500)]
+    words_set = set(words)
+    matcher = WordMatcher(words)
+    message = ' '.join(random.choice(words) if random.random() < 0.1 else 'hello' for _ in range(30)) + '!'
+
+    n = 10000
+    old = timeit.timeit(lambda: Counter(w for w in message.split() if w in words_set), number=n)
+    new = timeit.timeit(lambda: matcher.count(message), number=n)
+    print(f"set:         {n / old:>12,.0f} messages/s")
+    print(f"WordMatcher: {n / new:>12,.0f} messages/s")
@@ -0,0 +1,79 @@
+"""Lightweight in-memory ratelimits"""
+from __future__ import annotations
+
+import time
+from typing import Hashable
+
+
+class ExpiringRatelimit:
+    """Allows every key once per period.
+
+    Keys are stored with monotonic timestamps in two generations which rotate every period,
+    the older generation is dropped whole so there is never a sweep over all keys.
+    Memory is bounded by the keys seen in the last two periods and every hit is O(1).
+    """
+    period: float
+    _current: dict[Hashable, float]
+    _previous: dict[Hashable, float]
+    _rotated: float
+
+    def __init__(self, period: float) -> None:
+        self.period = period
+        self._current, self._previous = {}, {}
+        self._rotated = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} period={self.period} keys={len(self)}>"
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def hit(self, key: Hashable) -> bool:
+        """Returns whether the key is allowed right now and records it if it is"""
+        now = time.monotonic()
+        if now - self._rotated >= self.period:
+            # after two idle periods even the current generation is expired
+            self._previous = self._current if now - self._rotated < 2 * self.period else {}
+            self._current = {}
+            self._rotated = now
+
+        last = self._current.get(key)
+        if last is None:
+            last = self._previous.get(key)
+        if last is not None and now - last < self.period:
+            return False
+
+        self._current[key] = now
+        return True
+
+
+if __name__ == '__main__':
+    # benchmark with 100k active members against the old member-keyed dict of datetimes
+    import random
+    import tracemalloc
+    from datetime import datetime, timedelta
+
+    n = 100_000
+    members = [(random.getrandbits(63), random.getrandbits(63)) for _ in range(n)]
+    hits = random.choices(members, k=10 * n)
+
+    tracemalloc.start()
+    old: dict[tuple[int, int], datetime] = {}
+    ratelimit = timedelta(minutes=2)
+    start = time.perf_counter()
+    for member in hits:
+        last = old.get(member)
+        if last is None or datetime.now() - last > ratelimit:
+            old[member] = datetime.now()
+    elapsed = time.perf_counter() - start
+    print(f"dict[Member, datetime]: {len(hits) / elapsed:>12,.0f} messages/s {tracemalloc.get_traced_memory()[0] / 2**20:6.1f}MiB")
+    del old
+
+    new = ExpiringRatelimit(120)
+    keys = [guild << 64 | member for guild, member in hits]
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for key in keys:
+        new.hit(key)
+    elapsed = time.perf_counter() - start
+    print(f"ExpiringRatelimit:      {len(hits) / elapsed:>12,.0f} messages/s {(tracemalloc.get_traced_memory()[0] - base) / 2**20:6.1f}MiB")
@@ -2,12 +2,15 @@
 from __future__ import annotations
 
 import asyncio
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from itertools import repeat
 import inspect
 from typing import *  # type: ignore
 
+from .config import logger
+
 if TYPE_CHECKING: # 3.10 is not out yet techincally
     from typing_extensions import ParamSpec
 else:
@@ -132,7 +135,8 @@ class Paginator(Generic[T]):
             return cls(iterable)
         
         self = cls(iterable)
-        self.saved.append(await maybe_anext(self.it))
+        if not self.saved:
+            self.saved.append(await maybe_anext(self.it))
         return self
     
     def __repr__(self) -> str:
@@ -167,3 +171,75 @@ class Paginator(Generic[T]):
         self.index -= 1
         return self.curr
 
+
+class PrefetchBuffer(Generic[T]):
+    """A buffer of results which is topped up in the background.
+    
+    get() pops a buffered result and schedules a refill, it only waits for fetch when the buffer is empty.
+    fetch may return multiple results at once, errors of background refills are logged and
+    raised to the next get() that has to wait.
+    """
+    fetch: Callable[[], Awaitable[Iterable[T]]]
+    buffer: deque[T]
+    
+    def __init__(self, fetch: Callable[[], Awaitable[Iterable[T]]], size: int = 5) -> None:
+        self.fetch = fetch
+        self.size = size
+        self.buffer = deque()
+        self._filling: Optional[asyncio.Task[bool]] = None
+        self._arrived = asyncio.Event()
+    
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} buffered={len(self.buffer)}/{self.size}>"
+    
+    def __len__(self) -> int:
+        return len(self.buffer)
+    
+    def fill(self) -> asyncio.Task[bool]:
+        """Starts topping up the buffer unless it's already being topped up"""
+        if self._filling is None or self._filling.done():
+            self._filling = asyncio.create_task(self._fill())
+            self._filling.add_done_callback(self._filled)
+        return self._filling
+    
+    async def _fill(self) -> bool:
+        """Tops up the buffer, returns whether it stopped because fetch returned no results"""
+        while len(self.buffer) < self.size:
+            results = list(await self.fetch())
+            if not results:
+                return True
+            self.buffer.extend(results)
+            self._arrived.set()
+        return False
+    
+    def _filled(self, task: asyncio.Task[bool]) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Could not fill {self!r}: {task.exception()}")
+    
+    async def get(self) -> T:
+        """Pops a buffered result, waits for a refill only when there is none"""
+        while not self.buffer:
+            self._arrived.clear()
+            task = self.fill()
+            # wake up on the first result instead of waiting for the whole refill
+            arrived = asyncio.create_task(self._arrived.wait())
+            try:
+                await asyncio.wait({task, arrived}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                arrived.cancel()
+            
+            if not self.buffer and task.done():
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception() # type: ignore
+                if not task.cancelled() and task.result():
+                    raise LookupError("fetch did not return any results")
+                # other callers took the results, start another refill
+        
+        value = self.buffer.popleft()
+        self.fill()
+        return value
+    
+    def cancel(self) -> None:
+        """Stops topping up the buffer"""
+        if self._filling is not None:
+            self._filling.cancel()
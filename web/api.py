@@ -1,8 +1,11 @@
 from typing import Any, Optional, TYPE_CHECKING, Counter
 
-from fastapi import FastAPI, Response, Query
+from fastapi import FastAPI, Response, Query, Request
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, Field
+from utils import get_user_names
+
+from .snapshots import SnapshotStore
 
 if TYPE_CHECKING:
     from bot import CBot
@@ -19,10 +22,6 @@ class CApp(FastAPI, metaclass=CAppMeta):
     """An app that provides a reference to the bot singleton"""
     bot: "CBot"
 
-def _get_user_name(id: int) -> Optional[str]:
-    user = app.bot.get_user(id)
-    return str(user) if user else None
-
 app = CApp()
 
 
@@ -65,22 +64,33 @@ class SwearMember(BaseModel):
     swears: list[Swear]
     total: int
 
-@app.get("/swears/{guild}", tags=['swears'], summary="guild swears", response_model=list[SwearMember])
-async def guild_swears(guild: int, limit: int = Query(10, le=50)):
-    """A leaderboard of swears for a server"""
-    # there is a proper way to do this but I can't be fucked.
-    swears = [doc async for doc in app.bot.db.culturebot.swears.find({"guild": guild}).sort('total', -1).limit(limit)]
+async def _guild_swears(guild: int, limit: int) -> list[dict[str, Any]]:
+    swears = await app.bot.cogs["Misc"].swear_leaderboard(guild, limit, swears=None)  # type: ignore
+    names = await get_user_names(app.bot, [doc['member'] for doc in swears])
     return [
         {
             "rank": rank,
             "member": doc['member'],
-            "member_name": _get_user_name(doc['member']),
-            "swears": [{"rank": srank, "swear": swear, "amount": amount} for srank, (swear, amount) in enumerate(Counter(doc['swears']).most_common(), 1)],
+            "member_name": name,
+            "swears": [{"rank": srank, **swear} for srank, swear in enumerate(doc['swears'], 1)],
             "total": doc['total'],
         }
-        for rank, doc in enumerate(swears, 1)
+        for rank, (doc, name) in enumerate(zip(swears, names), 1)
     ]
 
+swear_snapshots = SnapshotStore(_guild_swears)
+
+async def on_swears_flush(guilds: set[int]) -> None:
+    swear_snapshots.invalidate(guilds)
+
+app.bot.add_listener(on_swears_flush)
+
+@app.get("/swears/{guild}", tags=['swears'], summary="guild swears", response_model=list[SwearMember])
+async def guild_swears(request: Request, guild: int, limit: int = Query(10, le=50)):
+    """A leaderboard of swears for a server"""
+    snapshot = await swear_snapshots.get(guild, limit)
+    return snapshot.response(request)
+
 
 @app.get("/swears/{guild}/{member}", tags=['swears'], summary="member swears", response_model=list[Swear])
 async def member_swears(guild: int, member: int):
@@ -95,16 +105,28 @@ class XPMember(BaseModel):
     member_name: Optional[str] = Field(None, example="Culture bot#7920")
     xp: int
 
-@app.get('/xp/{guild}', tags=['xp'], summary="guild xp leaderboard", response_model=list[XPMember])
-async def guild_xp(guild: int, limit: int = Query(10, le=50)):
-    xp = [doc async for doc in app.bot.db.xp.xp.find({"guild": guild}).sort('xp', -1).limit(limit)]
+async def _guild_xp(guild: int, limit: int, page: int) -> list[dict[str, Any]]:
+    xp = await app.bot.cogs["XP"].leaderboard_page(guild, limit, page * limit)  # type: ignore
+    names = await get_user_names(app.bot, [doc['member'] for doc in xp])
     return [
         {
             "rank": rank,
             "member": doc['member'],
-            "member_name": _get_user_name(doc['member']),
+            "member_name": name,
             "xp": doc["xp"]
         }
-        for rank, doc in enumerate(xp, 1)
+        for rank, (doc, name) in enumerate(zip(xp, names), page * limit + 1)
     ]
-    
\ No newline at end of file
+
+xp_snapshots = SnapshotStore(_guild_xp)
+
+async def on_xp_flush(guilds: set[int]) -> None:
+    xp_snapshots.invalidate(guilds)
+
+app.bot.add_listener(on_xp_flush)
+
+@app.get('/xp/{guild}', tags=['xp'], summary="guild xp leaderboard", response_model=list[XPMember])
+async def guild_xp(request: Request, guild: int, limit: int = Query(10, le=50), page: int = Query(0, ge=0)):
+    """A leaderboard of xp for a server"""
+    snapshot = await xp_snapshots.get(guild, limit, page)
+    return snapshot.response(request)
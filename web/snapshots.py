@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+from cachetools import TTLCache
+from fastapi import Request, Response
+
+
+class Snapshot:
+    """A materialised json response with precomputed compression and validators"""
+    body: bytes
+    gzipped: bytes
+    etag: str
+    created: float
+    ttl: float
+
+    def __init__(self, data: Any, ttl: float) -> None:
+        self.body = json.dumps(data, separators=(',', ':')).encode()
+        self.gzipped = gzip.compress(self.body)
+        self.etag = '"' + hashlib.md5(self.body).hexdigest() + '"'
+        self.created = time.time()
+        self.ttl = ttl
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} etag={self.etag} size={len(self.body)}>"
+
+    def not_modified(self, request: Request) -> bool:
+        """Checks the validators of a conditional request, If-None-Match takes precedence"""
+        if 'if-none-match' in request.headers:
+            return request.headers['if-none-match'] == self.etag
+        if 'if-modified-since' in request.headers:
+            try:
+                since = parsedate_to_datetime(request.headers['if-modified-since']).timestamp()
+            except (TypeError, ValueError):
+                return False
+            # Last-Modified only has a precision of seconds
+            return int(self.created) <= since
+        return False
+
+    def response(self, request: Request) -> Response:
+        """Creates a response, handles conditional requests and gzip"""
+        headers = {
+            'ETag': self.etag,
+            'Last-Modified': formatdate(self.created, usegmt=True),
+            'Cache-Control': f"public, max-age={max(int(self.created + self.ttl - time.time()), 0)}",
+            'Vary': 'Accept-Encoding',
+        }
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+
+        if 'gzip' in request.headers.get('accept-encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            return Response(self.gzipped, media_type='application/json', headers=headers)
+
+        return Response(self.body, media_type='application/json', headers=headers)
+
+
+class SnapshotStore:
+    """Snapshots of guild leaderboards keyed by the guild and the request parameters
+
+    Snapshots are rebuilt when they expire or after their guild was invalidated,
+    concurrent requests for a missing snapshot share a single build.
+    Every invalidation bumps the guild's generation, builds that overlap one aren't stored.
+    """
+    build: Callable[..., Awaitable[Any]]
+    snapshots: TTLCache[tuple[Hashable, ...], Snapshot]
+    _building: dict[tuple[Hashable, ...], asyncio.Task[Snapshot]]
+    _generations: dict[int, int]
+
+    def __init__(self, build: Callable[..., Awaitable[Any]], ttl: float = 300, maxsize: int = 1024) -> None:
+        self.build = build
+        self.ttl = ttl
+        self.snapshots = TTLCache(maxsize, ttl)
+        self._building = {}
+        self._generations = {}
+
+    def invalidate(self, guilds: Iterable[int]) -> None:
+        """Drops the snapshots and running builds of guilds whose data changed"""
+        guilds = set(guilds)
+        for guild in guilds:
+            self._generations[guild] = self._generations.get(guild, 0) + 1
+        for key in [key for key in self.snapshots if key[0] in guilds]:
+            self.snapshots.pop(key, None)
+        # running builds may have read old data, later requests must start a new one
+        for key in [key for key in self._building if key[0] in guilds]:
+            del self._building[key]
+
+    async def get(self, guild: int, *args: Hashable) -> Snapshot:
+        """Returns a snapshot, building it if it doesn't exist"""
+        key = (guild, *args)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        task = self._building.get(key)
+        if task is None:
+            generation = self._generations.get(guild, 0)
+            task = self._building[key] = asyncio.create_task(self._build(key, generation))
+        # shielded so a disconnecting client doesn't cancel the build for everyone else
+        return await asyncio.shield(task)
+
+    async def _build(self, key: tuple[Hashable, ...], generation: int) -> Snapshot:
+        try:
+            snapshot = Snapshot(await self.build(*key), self.ttl)
+            if self._generations.get(key[0], 0) == generation:
+                self.snapshots[key] = snapshot
+            return snapshot
+        finally:
+            if self._building.get(key) is asyncio.current_task():
+                del self._building[key]